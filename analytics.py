@@ -1,15 +1,32 @@
-import sqlite3
-from datetime import datetime
+import atexit
+import os
+import queue
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
 import json
 
+import event_store
+from db import get_connection
+from metrics import timed
+from worker_thread import WorkerThread
+
 DB_PATH = "analytics.db"
 
+# Таблицы, из которых строятся свёртки статистики
+ROLLUP_SOURCES = ("sessions", "ratings", "answers")
+ANSWER_QUESTIONS = ("gender", "age", "relationship", "occasion")
 
-def init_db():
-    """Создаёт таблицы аналитики"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
+# Фоновая запись: ANALYTICS_ASYNC=0 — писать сразу в обработчике запроса
+ASYNC_WRITES = os.environ.get("ANALYTICS_ASYNC", "1") != "0"
+WRITER_QUEUE_SIZE = int(os.environ.get("ANALYTICS_QUEUE_SIZE", "10000"))
+WRITER_BATCH_SIZE = int(os.environ.get("ANALYTICS_BATCH_SIZE", "500"))
+WRITER_FLUSH_INTERVAL = int(os.environ.get("ANALYTICS_FLUSH_MS", "200")) / 1000
+
+
+def _migration_1_tables(cursor):
+    """Таблицы аналитики"""
     # Сессии подбора
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS sessions (
@@ -54,7 +71,8 @@ def init_db():
         )
     ''')
     
-    # События воронки
+    # События воронки (теперь пишутся в базы месяцев event_store.py,
+    # перенос старых: python event_store.py migrate)
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS events (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -66,141 +84,613 @@ def init_db():
         )
     ''')
     
-    conn.commit()
-    conn.close()
-    print("✅ База аналитики создана")
+    # Агрегаты оценок по профилю (пол, возраст, повод) — для коллаборативной фильтрации
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'profile_gift_stats'"
+    )
+    stats_exists = cursor.fetchone() is not None
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS profile_gift_stats (
+            gender TEXT NOT NULL,
+            age TEXT NOT NULL,
+            occasion TEXT NOT NULL,
+            gift_id INTEGER NOT NULL,
+            likes INTEGER NOT NULL DEFAULT 0,
+            dislikes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (gender, age, occasion, gift_id)
+        ) WITHOUT ROWID
+    ''')
+    
+    # Таблица только что появилась — заполняем из уже накопленных оценок
+    if not stats_exists:
+        _rebuild_profile_gift_stats(cursor)
 
 
-def create_session(source: str, user_id: str = None) -> int:
-    """Создаёт новую сессию, возвращает session_id"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def _migration_2_indexes(cursor):
+    """Составные индексы под запросы записи, коллаборативного скоринга и статистики"""
+    # Есть ли у сессии этот профиль; профили сессии при новой оценке
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_answers_session_profile
+        ON answers (session_id, gender, age, occasion)
+    ''')
     
-    cursor.execute(
-        'INSERT INTO sessions (source, user_id) VALUES (?, ?)',
-        (source, user_id)
+    # Оценки сессии при смене профиля
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ratings_session_gift
+        ON ratings (session_id, gift_id, rating)
+    ''')
+    
+    # Рейтинг подарков: группировка по gift_id без сортировки всей таблицы
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ratings_gift
+        ON ratings (gift_id, gift_name, rating)
+    ''')
+    
+    # События сессии по типу
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_events_session_type
+        ON events (session_id, event_type)
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sessions_completed
+        ON sessions (completed)
+    ''')
+
+
+def _migration_3_rollups(cursor):
+    """Свёртки для статистики, дополняются по водяным знакам на id (refresh_rollups)"""
+    # Последний учтённый id каждой исходной таблицы
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_watermarks (
+            source TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    cursor.executemany(
+        'INSERT OR IGNORE INTO rollup_watermarks (source, last_id) VALUES (?, 0)',
+        [(source,) for source in ROLLUP_SOURCES]
     )
-    session_id = cursor.lastrowid
     
-    conn.commit()
-    conn.close()
+    # Воронка по дню начала сессии: сколько начато, завершено, получило оценки
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_funnel (
+            day TEXT PRIMARY KEY,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            rated INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
     
-    return session_id
+    # Распределение ответов по дням; пустой ответ хранится как ''
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_answers (
+            day TEXT NOT NULL,
+            question TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, question, answer)
+        ) WITHOUT ROWID
+    ''')
+    
+    # Лайки и дизлайки подарков за всё время
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS gift_rating_totals (
+            gift_id INTEGER NOT NULL,
+            gift_name TEXT NOT NULL,
+            likes INTEGER NOT NULL DEFAULT 0,
+            dislikes INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (gift_id, gift_name)
+        ) WITHOUT ROWID
+    ''')
 
 
-def save_answers(session_id: int, filters: dict, value_weights: dict, interests: list):
-    """Сохраняет ответы пользователя (профиль)"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def _migration_4_drop_stats_indexes(cursor):
+    """Индексы полных проходов статистики: её теперь читают из свёрток, а запись они замедляют"""
+    cursor.execute('DROP INDEX IF EXISTS idx_ratings_gift')
+    cursor.execute('DROP INDEX IF EXISTS idx_sessions_completed')
+
+
+# Миграции схемы по порядку; номер применённой хранится в PRAGMA user_version.
+# Новые миграции только дописываются в конец.
+MIGRATIONS = [
+    _migration_1_tables,
+    _migration_2_indexes,
+    _migration_3_rollups,
+    _migration_4_drop_stats_indexes,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+@contextmanager
+def _write_transaction(conn):
+    """
+    Транзакция, сразу берущая блокировку записи (BEGIN IMMEDIATE).
     
+    Чтение и запись внутри видят одно состояние базы: другие процессы
+    не могут ничего закоммитить между ними.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn.cursor()
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def init_db():
+    """Создаёт таблицы аналитики и применяет недостающие миграции"""
+    conn = get_connection(DB_PATH)
+    
+    if schema_version(conn) < SCHEMA_VERSION:
+        # Воркеры, стартующие одновременно, мигрируют по очереди
+        with _write_transaction(conn) as cursor:
+            version = schema_version(conn)
+            for migration in MIGRATIONS[version:]:
+                migration(cursor)
+            cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        
+        if version < SCHEMA_VERSION:
+            print(f"✅ Схема аналитики обновлена: версия {version} → {SCHEMA_VERSION}")
+    
+    print("✅ База аналитики создана")
+
+
+def _rebuild_profile_gift_stats(cursor):
+    """Пересчитывает profile_gift_stats с нуля по answers и ratings"""
+    cursor.execute('DELETE FROM profile_gift_stats')
     cursor.execute('''
-        INSERT INTO answers (
-            session_id, gender, age, relationship, occasion, budget,
-            experience, practical_emotional, daily_use, aesthetic, interests
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        session_id,
-        filters.get('gender'),
-        filters.get('age'),
-        filters.get('relationship'),
-        filters.get('occasion'),
-        json.dumps(filters.get('budget', [])),
-        value_weights.get('gift_experience'),
-        'practical' if value_weights.get('gift_practical') == 1 else ('emotional' if value_weights.get('gift_emotional') == 1 else 'neutral'),
-        value_weights.get('gift_daily_use'),
-        value_weights.get('gift_aesthetic'),
-        json.dumps(interests)
-    ))
+        INSERT INTO profile_gift_stats (gender, age, occasion, gift_id, likes, dislikes)
+        SELECT 
+            p.gender,
+            p.age,
+            p.occasion,
+            r.gift_id,
+            SUM(CASE WHEN r.rating = 1 THEN 1 ELSE 0 END),
+            SUM(CASE WHEN r.rating = -1 THEN 1 ELSE 0 END)
+        FROM (
+            SELECT DISTINCT session_id, gender, age, occasion
+            FROM answers
+            WHERE gender IS NOT NULL AND age IS NOT NULL AND occasion IS NOT NULL
+        ) p
+        JOIN ratings r ON r.session_id = p.session_id
+        GROUP BY p.gender, p.age, p.occasion, r.gift_id
+    ''')
+
+
+def rebuild_profile_gift_stats():
+    """Полностью пересобирает агрегаты оценок по профилям"""
+    conn = get_connection(DB_PATH)
+    with conn:
+        cursor = conn.cursor()
+        _rebuild_profile_gift_stats(cursor)
+    
+    cursor.execute('SELECT COUNT(*) FROM profile_gift_stats')
+    rows = cursor.fetchone()[0]
     
-    conn.commit()
-    conn.close()
+    return rows
 
 
-def save_rating(session_id: int, gift_id: int, gift_name: str, rating: int):
-    """Сохраняет оценку подарка (+1 лайк, -1 дизлайк)"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def create_session(source: str, user_id: str = None, created_at: str = None) -> int:
+    """Создаёт новую сессию, возвращает session_id"""
+    conn = get_connection(DB_PATH)
+    with timed("analytics_session"), conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'INSERT INTO sessions (source, user_id, created_at) VALUES (?, ?, COALESCE(?, CURRENT_TIMESTAMP))',
+            (source, user_id, created_at)
+        )
+        session_id = cursor.lastrowid
     
-    cursor.execute(
-        'INSERT INTO ratings (session_id, gift_id, gift_name, rating) VALUES (?, ?, ?, ?)',
-        (session_id, gift_id, gift_name, rating)
+    return session_id
+
+
+def utc_now() -> str:
+    """Текущее время в формате CURRENT_TIMESTAMP (UTC)"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _write_answers(cursor, rows: list):
+    """Вставляет ответы [(session_id, filters, value_weights, interests, created_at), ...]"""
+    for session_id, filters, value_weights, interests, created_at in rows:
+        gender = filters.get('gender')
+        age = filters.get('age')
+        occasion = filters.get('occasion')
+        
+        # Если у сессии появился новый профиль — её прошлые оценки начинают
+        # учитываться в агрегатах этого профиля
+        if gender is not None and age is not None and occasion is not None:
+            cursor.execute('''
+                SELECT 1 FROM answers
+                WHERE session_id = ? AND gender = ? AND age = ? AND occasion = ?
+                LIMIT 1
+            ''', (session_id, gender, age, occasion))
+            
+            if cursor.fetchone() is None:
+                cursor.execute('''
+                    INSERT INTO profile_gift_stats (gender, age, occasion, gift_id, likes, dislikes)
+                    SELECT 
+                        ?, ?, ?,
+                        gift_id,
+                        SUM(CASE WHEN rating = 1 THEN 1 ELSE 0 END),
+                        SUM(CASE WHEN rating = -1 THEN 1 ELSE 0 END)
+                    FROM ratings
+                    WHERE session_id = ?
+                    GROUP BY gift_id
+                    ON CONFLICT (gender, age, occasion, gift_id) DO UPDATE SET
+                        likes = likes + excluded.likes,
+                        dislikes = dislikes + excluded.dislikes
+                ''', (gender, age, occasion, session_id))
+        
+        cursor.execute('''
+            INSERT INTO answers (
+                session_id, gender, age, relationship, occasion, budget,
+                experience, practical_emotional, daily_use, aesthetic, interests,
+                created_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+        ''', (
+            session_id,
+            gender,
+            age,
+            filters.get('relationship'),
+            occasion,
+            json.dumps(filters.get('budget', [])),
+            value_weights.get('gift_experience'),
+            'practical' if value_weights.get('gift_practical') == 1 else ('emotional' if value_weights.get('gift_emotional') == 1 else 'neutral'),
+            value_weights.get('gift_daily_use'),
+            value_weights.get('gift_aesthetic'),
+            json.dumps(interests),
+            created_at
+        ))
+
+
+def _write_ratings(cursor, rows: list):
+    """Вставляет оценки [(session_id, gift_id, gift_name, rating, created_at), ...]"""
+    cursor.executemany(
+        '''INSERT INTO ratings (session_id, gift_id, gift_name, rating, created_at)
+           VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))''',
+        rows
     )
     
-    conn.commit()
-    conn.close()
+    # Обновляем агрегаты для всех профилей этих сессий
+    cursor.executemany('''
+        INSERT INTO profile_gift_stats (gender, age, occasion, gift_id, likes, dislikes)
+        SELECT DISTINCT gender, age, occasion, ?, ?, ?
+        FROM answers
+        WHERE session_id = ?
+          AND gender IS NOT NULL AND age IS NOT NULL AND occasion IS NOT NULL
+        ON CONFLICT (gender, age, occasion, gift_id) DO UPDATE SET
+            likes = likes + excluded.likes,
+            dislikes = dislikes + excluded.dislikes
+    ''', [
+        (gift_id, 1 if rating == 1 else 0, 1 if rating == -1 else 0, session_id)
+        for session_id, gift_id, gift_name, rating, created_at in rows
+    ])
+
+
+def _write_events(rows: list):
+    """Пишет события [(session_id, event_type, event_data, created_at), ...] в базы месяцев (event_store)"""
+    event_store.write_events([
+        (session_id, event_type, json.dumps(event_data) if event_data else None, created_at or utc_now())
+        for session_id, event_type, event_data, created_at in rows
+    ])
+
+
+def _write_completions(cursor, rows: list):
+    """Помечает сессии [(session_id,), ...] завершёнными"""
+    rows = list(dict.fromkeys(rows))
+    
+    # Сессия уже учтена в daily_funnel (id не выше водяного знака) — учитываем
+    # и её завершение; более новые сессии refresh_rollups посчитает сам
+    cursor.executemany('''
+        UPDATE daily_funnel SET completed = completed + 1
+        WHERE day = (
+            SELECT date(created_at) FROM sessions
+            WHERE id = ? AND completed = 0
+              AND id <= (SELECT last_id FROM rollup_watermarks WHERE source = 'sessions')
+        )
+    ''', rows)
+    cursor.executemany('UPDATE sessions SET completed = 1 WHERE id = ?', rows)
+
+
+_WRITERS = {
+    'answers': _write_answers,
+    'ratings': _write_ratings,
+    'completions': _write_completions,
+}
+
+
+def _write_analytics(items: list):
+    """Пишет [(kind, row), ...] в analytics.db одной транзакцией"""
+    # Подряд идущие строки одного типа пишутся одним executemany
+    groups = []
+    for kind, row in items:
+        if groups and groups[-1][0] == kind:
+            groups[-1][1].append(row)
+        else:
+            groups.append((kind, [row]))
+    
+    conn = get_connection(DB_PATH)
+    with conn:
+        cursor = conn.cursor()
+        for kind, rows in groups:
+            _WRITERS[kind](cursor, rows)
+
+
+# Пишут не в analytics.db: без курсора и вне её транзакции
+_STORE_WRITERS = {
+    'events': _write_events,
+}
+
+
+def save_answers(session_id: int, filters: dict, value_weights: dict, interests: list):
+    """Сохраняет ответы пользователя (профиль)"""
+    conn = get_connection(DB_PATH)
+    with conn:
+        _write_answers(conn.cursor(), [(session_id, filters, value_weights, interests, None)])
+
+
+def save_rating(session_id: int, gift_id: int, gift_name: str, rating: int):
+    """Сохраняет оценку подарка (+1 лайк, -1 дизлайк)"""
+    conn = get_connection(DB_PATH)
+    with conn:
+        _write_ratings(conn.cursor(), [(session_id, gift_id, gift_name, rating, None)])
 
 
 def save_event(session_id: int, event_type: str, event_data: dict = None):
     """Сохраняет событие воронки"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        'INSERT INTO events (session_id, event_type, event_data) VALUES (?, ?, ?)',
-        (session_id, event_type, json.dumps(event_data) if event_data else None)
-    )
-    
-    conn.commit()
-    conn.close()
+    _write_events([(session_id, event_type, event_data, None)])
 
 
 def complete_session(session_id: int):
     """Помечает сессию как завершённую"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    conn = get_connection(DB_PATH)
+    with conn:
+        _write_completions(conn.cursor(), [(session_id,)])
+
+
+# ============== ФОНОВАЯ ЗАПИСЬ ==============
+
+class AnalyticsWriter:
+    """
+    Фоновая пакетная запись аналитики.
     
-    cursor.execute(
-        'UPDATE sessions SET completed = 1 WHERE id = ?',
-        (session_id,)
-    )
+    Обработчики запросов только кладут строки в ограниченную очередь. Поток
+    записи раз в flush_interval секунд (или при накоплении batch_size строк)
+    пишет всё накопленное одной транзакцией через executemany. Порядок записей
+    сохраняется. Если очередь переполнена, запись отбрасывается и учитывается
+    в счётчике dropped.
+    """
     
-    conn.commit()
-    conn.close()
+    def __init__(self, maxsize: int = None, batch_size: int = None, flush_interval: float = None):
+        self.maxsize = maxsize if maxsize is not None else WRITER_QUEUE_SIZE
+        self.batch_size = batch_size if batch_size is not None else WRITER_BATCH_SIZE
+        self.flush_interval = flush_interval if flush_interval is not None else WRITER_FLUSH_INTERVAL
+        
+        self.queue = queue.Queue(self.maxsize)
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        
+        self._thread = WorkerThread(self._run, "analytics-writer", on_new_process=self._on_new_process)
+        self._atexit_registered = False
+    
+    def _on_new_process(self):
+        # Строки из очереди родителя дописывает сам родитель
+        self.queue = queue.Queue(self.maxsize)
+        if not self._atexit_registered:
+            atexit.register(self.close)
+            self._atexit_registered = True
+    
+    def put(self, kind: str, row: tuple) -> bool:
+        """Ставит строку в очередь; False — очередь переполнена, запись отброшена"""
+        self._thread.ensure_started()
+        try:
+            self.queue.put_nowait((kind, row))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+    
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            
+            # Добираем пачку, пока не истёк интервал или не набрался batch_size
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            
+            try:
+                self.write_batch(batch)
+            finally:
+                for _ in range(len(batch) + (1 if stop else 0)):
+                    self.queue.task_done()
+            
+            if stop:
+                return
+    
+    def write_batch(self, batch: list):
+        """Пишет пачку [(kind, row), ...]: analytics.db одной транзакцией, события — отдельно"""
+        items = []
+        stored = {}
+        for kind, row in batch:
+            if kind in _STORE_WRITERS:
+                stored.setdefault(kind, []).append(row)
+            else:
+                items.append((kind, row))
+        
+        written = 0
+        with timed("analytics_flush"):
+            if items:
+                written += self._write_rows("аналитики", _write_analytics, items)
+            for kind, rows in stored.items():
+                written += self._write_rows(kind, _STORE_WRITERS[kind], rows)
+        
+        self.written += written
+        if written:
+            self.batches += 1
+    
+    def _write_rows(self, label: str, write, rows: list) -> int:
+        """
+        Пишет rows одним вызовом write; если пачка не записалась — по одной
+        строке, чтобы из-за испорченной строки не терялись остальные.
+        Возвращает число записанных строк.
+        """
+        try:
+            write(rows)
+            return len(rows)
+        except Exception as e:
+            if len(rows) == 1:
+                self.failed += 1
+                print(f"⚠️ Строка {label} не записана и отброшена: {e}: {rows[0]!r}", file=sys.stderr)
+                return 0
+            print(f"⚠️ Пачка {label} ({len(rows)} строк) не записалась: {e}; пишем по одной", file=sys.stderr)
+        
+        written = 0
+        for row in rows:
+            try:
+                write([row])
+                written += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"⚠️ Строка {label} не записана и отброшена: {e}: {row!r}", file=sys.stderr)
+        return written
+    
+    def flush(self):
+        """Ждёт, пока всё поставленное в очередь будет записано"""
+        if self._thread.is_alive():
+            self.queue.join()
+    
+    def close(self):
+        """Дописывает очередь и останавливает поток (вызывается при выходе воркера)"""
+        # Очередь, унаследованную при fork, дописывает родительский процесс
+        if not self._thread.owned():
+            return
+        
+        if self._thread.is_alive():
+            try:
+                self.queue.put(None, timeout=self.flush_interval + 1)
+            except queue.Full:
+                pass
+            self._thread.join(timeout=10)
+        
+        # Если поток уже не работает — дописываем остаток сами
+        batch = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self.queue.task_done()
+            if item is not None:
+                batch.append(item)
+        if batch:
+            self.write_batch(batch)
+    
+    def stats(self) -> dict:
+        """Счётчики фоновой записи"""
+        return {
+            'queued': self.queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'batches': self.batches,
+        }
+
+
+writer = AnalyticsWriter()
+
+
+# Этап в метриках и Server-Timing для каждого типа записи
+ENQUEUE_STAGES = {
+    'answers': "analytics_enqueue_answers",
+    'ratings': "analytics_enqueue_rating",
+    'completions': "analytics_enqueue_completion",
+    'events': "analytics_enqueue_event",
+}
+
+
+def _enqueue(kind: str, row: tuple):
+    with timed(ENQUEUE_STAGES[kind]):
+        if ASYNC_WRITES:
+            writer.put(kind, row)
+        elif kind in _STORE_WRITERS:
+            _STORE_WRITERS[kind]([row])
+        else:
+            _write_analytics([(kind, row)])
+
+
+def queue_answers(session_id: int, filters: dict, value_weights: dict, interests: list):
+    """Ставит в очередь сохранение ответов (см. save_answers)"""
+    _enqueue('answers', (session_id, filters, value_weights, interests, utc_now()))
+
+
+def queue_rating(session_id: int, gift_id: int, gift_name: str, rating: int):
+    """Ставит в очередь сохранение оценки (см. save_rating)"""
+    _enqueue('ratings', (session_id, gift_id, gift_name, rating, utc_now()))
+
+
+def queue_event(session_id: int, event_type: str, event_data: dict = None, created_at: str = None):
+    """Ставит в очередь сохранение события (см. save_event)"""
+    _enqueue('events', (session_id, event_type, event_data, created_at or utc_now()))
+
+
+def queue_complete_session(session_id: int):
+    """Ставит в очередь завершение сессии (см. complete_session)"""
+    _enqueue('completions', (session_id,))
 
 
 def get_collaborative_score(gift_id: int, filters: dict) -> float:
     """
     Рассчитывает бонус на основе лайков похожих пользователей.
     
-    Ищет сессии с похожим профилем и смотрит их оценки этого подарка.
+    Берёт готовые агрегаты оценок этого подарка для профиля (пол, возраст, повод).
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection(DB_PATH)
     cursor = conn.cursor()
     
-    # Находим похожие сессии (совпадение по gender, age, occasion)
     cursor.execute('''
-        SELECT a.session_id 
-        FROM answers a
-        WHERE a.gender = ? 
-          AND a.age = ?
-          AND a.occasion = ?
+        SELECT likes, dislikes
+        FROM profile_gift_stats
+        WHERE gender = ? AND age = ? AND occasion = ? AND gift_id = ?
     ''', (
         filters.get('gender'),
         filters.get('age'),
-        filters.get('occasion')
+        filters.get('occasion'),
+        gift_id
     ))
     
-    similar_sessions = [row[0] for row in cursor.fetchall()]
+    row = cursor.fetchone()
     
-    if not similar_sessions:
-        conn.close()
+    if row is None:
         return 0.0
     
-    # Считаем лайки и дизлайки этого подарка
-    placeholders = ','.join(['?' for _ in similar_sessions])
-    cursor.execute(f'''
-        SELECT 
-            SUM(CASE WHEN rating = 1 THEN 1 ELSE 0 END) as likes,
-            SUM(CASE WHEN rating = -1 THEN 1 ELSE 0 END) as dislikes
-        FROM ratings
-        WHERE session_id IN ({placeholders}) AND gift_id = ?
-    ''', similar_sessions + [gift_id])
-    
-    row = cursor.fetchone()
-    conn.close()
-    
-    likes = row[0] or 0
-    dislikes = row[1] or 0
+    likes, dislikes = row
     
     total = likes + dislikes
     if total == 0:
@@ -217,21 +707,134 @@ def get_collaborative_score(gift_id: int, filters: dict) -> float:
 
 # ============== СТАТИСТИКА ==============
 
+def _refresh_rollups(cursor):
+    """Дописывает в свёртки строки с id выше водяных знаков и сдвигает знаки"""
+    cursor.execute('SELECT source, last_id FROM rollup_watermarks')
+    watermarks = dict(cursor.fetchall())
+    
+    def new_rows(source):
+        cursor.execute(f'SELECT MAX(id) FROM {source}')
+        top = cursor.fetchone()[0] or 0
+        last_id = watermarks.get(source, 0)
+        return (last_id, top) if top > last_id else None
+    
+    def advance(source, top):
+        cursor.execute('UPDATE rollup_watermarks SET last_id = ? WHERE source = ?', (top, source))
+    
+    # Сессии раньше оценок: сессия каждой новой оценки уже учтена в daily_funnel
+    span = new_rows('sessions')
+    if span:
+        cursor.execute('''
+            INSERT INTO daily_funnel (day, sessions, completed)
+            SELECT 
+                date(created_at),
+                COUNT(*),
+                SUM(CASE WHEN completed = 1 THEN 1 ELSE 0 END)
+            FROM sessions
+            WHERE id > ? AND id <= ?
+            GROUP BY 1
+            ON CONFLICT (day) DO UPDATE SET
+                sessions = sessions + excluded.sessions,
+                completed = completed + excluded.completed
+        ''', span)
+        advance('sessions', span[1])
+    
+    span = new_rows('ratings')
+    if span:
+        # Сессия с оценками учитывается один раз — если до водяного знака
+        # оценок у неё не было
+        cursor.execute('''
+            INSERT INTO daily_funnel (day, rated)
+            SELECT COALESCE(date(s.created_at), date(r.created_at)), COUNT(*)
+            FROM (
+                SELECT session_id, MIN(id) AS first_id
+                FROM ratings
+                WHERE id > ? AND id <= ?
+                GROUP BY session_id
+            ) n
+            JOIN ratings r ON r.id = n.first_id
+            LEFT JOIN sessions s ON s.id = n.session_id
+            WHERE NOT EXISTS (
+                SELECT 1 FROM ratings p WHERE p.session_id = n.session_id AND p.id <= ?
+            )
+            GROUP BY 1
+            ON CONFLICT (day) DO UPDATE SET rated = rated + excluded.rated
+        ''', span + (span[0],))
+        
+        cursor.execute('''
+            INSERT INTO gift_rating_totals (gift_id, gift_name, likes, dislikes, total)
+            SELECT 
+                gift_id,
+                COALESCE(gift_name, ''),
+                SUM(CASE WHEN rating = 1 THEN 1 ELSE 0 END),
+                SUM(CASE WHEN rating = -1 THEN 1 ELSE 0 END),
+                COUNT(*)
+            FROM ratings
+            WHERE id > ? AND id <= ?
+            GROUP BY 1, 2
+            ON CONFLICT (gift_id, gift_name) DO UPDATE SET
+                likes = likes + excluded.likes,
+                dislikes = dislikes + excluded.dislikes,
+                total = total + excluded.total
+        ''', span)
+        advance('ratings', span[1])
+    
+    span = new_rows('answers')
+    if span:
+        # Один проход по новым ответам, раскладка по вопросам — в Python
+        cursor.execute(f'''
+            SELECT date(created_at), {', '.join(ANSWER_QUESTIONS)}, COUNT(*)
+            FROM answers
+            WHERE id > ? AND id <= ?
+            GROUP BY {', '.join(str(i) for i in range(1, len(ANSWER_QUESTIONS) + 2))}
+        ''', span)
+        counts = {}
+        for day, *answers, count in cursor.fetchall():
+            for question, answer in zip(ANSWER_QUESTIONS, answers):
+                key = (day, question, answer or '')
+                counts[key] = counts.get(key, 0) + count
+        
+        cursor.executemany('''
+            INSERT INTO daily_answers (day, question, answer, count)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (day, question, answer) DO UPDATE SET
+                count = count + excluded.count
+        ''', [key + (count,) for key, count in counts.items()])
+        advance('answers', span[1])
+
+
+def refresh_rollups():
+    """Досчитывает свёртки статистики по новым строкам"""
+    conn = get_connection(DB_PATH)
+    with timed("analytics_rollup"), _write_transaction(conn) as cursor:
+        _refresh_rollups(cursor)
+
+
+def rebuild_rollups():
+    """Пересчитывает свёртки статистики с нуля"""
+    conn = get_connection(DB_PATH)
+    with _write_transaction(conn) as cursor:
+        for table in ('daily_funnel', 'daily_answers', 'gift_rating_totals'):
+            cursor.execute(f'DELETE FROM {table}')
+        cursor.execute('UPDATE rollup_watermarks SET last_id = 0')
+        _refresh_rollups(cursor)
+
+
 def get_funnel_stats():
     """Статистика воронки"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT COUNT(*) FROM sessions')
-    total_sessions = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM sessions WHERE completed = 1')
-    completed_sessions = cursor.fetchone()[0]
+    refresh_rollups()
     
-    cursor.execute('SELECT COUNT(DISTINCT session_id) FROM ratings')
-    sessions_with_ratings = cursor.fetchone()[0]
+    conn = get_connection(DB_PATH)
+    cursor = conn.cursor()
     
-    conn.close()
+    cursor.execute('''
+        SELECT 
+            COALESCE(SUM(sessions), 0),
+            COALESCE(SUM(completed), 0),
+            COALESCE(SUM(rated), 0)
+        FROM daily_funnel
+    ''')
+    total_sessions, completed_sessions, sessions_with_ratings = cursor.fetchone()
     
     return {
         'total_sessions': total_sessions,
@@ -241,63 +844,70 @@ def get_funnel_stats():
     }
 
 
-def get_answer_distribution():
-    """Распределение ответов по вопросам"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def get_daily_funnel(days: int = 7) -> list:
+    """Воронка за последние days дней начала сессий, от новых к старым"""
+    refresh_rollups()
     
-    stats = {}
-    
-    # Пол
-    cursor.execute('SELECT gender, COUNT(*) FROM answers GROUP BY gender')
-    stats['gender'] = {row[0]: row[1] for row in cursor.fetchall()}
+    conn = get_connection(DB_PATH)
+    cursor = conn.cursor()
     
-    # Возраст
-    cursor.execute('SELECT age, COUNT(*) FROM answers GROUP BY age')
-    stats['age'] = {row[0]: row[1] for row in cursor.fetchall()}
+    cursor.execute('''
+        SELECT day, sessions, completed, rated
+        FROM daily_funnel
+        ORDER BY day DESC
+        LIMIT ?
+    ''', (days,))
+    
+    return [
+        {'day': row[0], 'sessions': row[1], 'completed': row[2], 'sessions_with_ratings': row[3]}
+        for row in cursor.fetchall()
+    ]
+
+
+def get_answer_distribution():
+    """Распределение ответов по вопросам"""
+    refresh_rollups()
     
-    # Отношения
-    cursor.execute('SELECT relationship, COUNT(*) FROM answers GROUP BY relationship')
-    stats['relationship'] = {row[0]: row[1] for row in cursor.fetchall()}
+    conn = get_connection(DB_PATH)
+    cursor = conn.cursor()
     
-    # Повод
-    cursor.execute('SELECT occasion, COUNT(*) FROM answers GROUP BY occasion')
-    stats['occasion'] = {row[0]: row[1] for row in cursor.fetchall()}
+    cursor.execute('''
+        SELECT question, answer, SUM(count)
+        FROM daily_answers
+        GROUP BY question, answer
+    ''')
     
-    conn.close()
+    stats = {question: {} for question in ANSWER_QUESTIONS}
+    for question, answer, count in cursor.fetchall():
+        stats[question][answer or None] = count
     
     return stats
 
 
 def get_gift_ratings():
     """Рейтинг подарков по лайкам"""
-    conn = sqlite3.connect(DB_PATH)
+    refresh_rollups()
+    
+    conn = get_connection(DB_PATH)
     cursor = conn.cursor()
     
     cursor.execute('''
-        SELECT 
-            gift_id,
-            gift_name,
-            SUM(CASE WHEN rating = 1 THEN 1 ELSE 0 END) as likes,
-            SUM(CASE WHEN rating = -1 THEN 1 ELSE 0 END) as dislikes,
-            COUNT(*) as total
-        FROM ratings
-        GROUP BY gift_id, gift_name
-        ORDER BY likes - dislikes DESC
+        SELECT gift_id, gift_name, likes, dislikes, total
+        FROM gift_rating_totals
+        ORDER BY likes - dislikes DESC, gift_id, gift_name
     ''')
     
     results = []
     for row in cursor.fetchall():
         results.append({
             'gift_id': row[0],
-            'gift_name': row[1],
+            'gift_name': row[1] or None,
             'likes': row[2],
             'dislikes': row[3],
             'total': row[4],
             'score': row[2] - row[3]
         })
     
-    conn.close()
     return results
 
 
@@ -312,7 +922,11 @@ def print_stats():
     print(f"   Всего сессий: {funnel['total_sessions']}")
     print(f"   Завершено: {funnel['completed_sessions']} ({funnel['completion_rate']}%)")
     print(f"   С оценками: {funnel['sessions_with_ratings']}")
-    
+
+    print(f"\n📅 ПО ДНЯМ (начато / завершено / с оценками):")
+    for day in get_daily_funnel():
+        print(f"   {day['day']}: {day['sessions']} / {day['completed']} / {day['sessions_with_ratings']}")
+
     dist = get_answer_distribution()
     print(f"\n📋 РАСПРЕДЕЛЕНИЕ ОТВЕТОВ:")
     
@@ -344,4 +958,11 @@ init_db()
 
 
 if __name__ == "__main__":
-    print_stats()
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "rebuild-stats":
+        rows = rebuild_profile_gift_stats()
+        print(f"✅ Агрегаты оценок пересобраны: {rows} строк")
+    elif len(sys.argv) > 1 and sys.argv[1] == "rebuild-rollups":
+        rebuild_rollups()
+        print("✅ Свёртки статистики пересобраны")
+    else:
+        print_stats()
\ No newline at end of file
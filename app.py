@@ -1,14 +1,40 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, Response, render_template, request, jsonify, session, g
+from catalog import BUDGET_ORDER, get_catalog
 from scoring import get_top_gifts
+from results_cache import results_cache, make_key
 from analytics import (
-    create_session, save_answers, save_rating, 
-    save_event, complete_session
+    create_session, queue_answers, queue_rating,
+    queue_event, queue_complete_session, utc_now, writer
 )
+import assets
+import collaborative
+import base64
+import hashlib
+import json
+import math
+import metrics
+from compression import compress_response
+from jinja2.utils import htmlsafe_json_dumps
+from payloads import StaticPayload
+from profiling import profile_slow_requests, set_profile_tags
+import os
 import secrets
+import time
 
 app = Flask(__name__)
 app.secret_key = secrets.token_hex(16)
 
+# Сжатие ответов и версионированные URL статики
+app.after_request(compress_response)
+assets.init_app(app)
+
+# Заголовок Server-Timing с таймингами этапов (SERVER_TIMING=1)
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+
+# Сколько подарков ранжируем на запрос и максимальный размер страницы
+RESULTS_LIMIT = 100
+MAX_PAGE_SIZE = 50
+
 # Вопросы (те же что в боте)
 QUESTIONS = [
     {
@@ -181,6 +207,31 @@ INTERESTS_ELDERLY = [
 ]
 
 
+# Статические ответы сериализуются один раз при старте
+QUESTIONS_JSON = htmlsafe_json_dumps(QUESTIONS, ensure_ascii=False)
+QUESTIONS_PAYLOAD = StaticPayload(QUESTIONS)
+INTERESTS_BY_GROUP = {
+    'male': INTERESTS_MALE,
+    'female': INTERESTS_FEMALE,
+    'elderly': INTERESTS_ELDERLY,
+}
+INTERESTS_PAYLOADS = {group: StaticPayload(options) for group, options in INTERESTS_BY_GROUP.items()}
+
+
+def interests_group(gender, age) -> str:
+    """Какой список интересов показать получателю: 'elderly', 'female' или 'male'"""
+    if age == 'age_65plus':
+        return 'elderly'
+    elif gender == 'gender_female':
+        return 'female'
+    return 'male'
+
+
+def interests_for(gender, age) -> list:
+    """Варианты интересов, которые /api/interests отдаёт этому получателю"""
+    return INTERESTS_BY_GROUP[interests_group(gender, age)]
+
+
 def get_budget_tags(selected_budget):
     all_budgets = ["budget_2000", "budget_5000", "budget_10000", "budget_15000",
                    "budget_20000", "budget_30000", "budget_50000", "budget_100000"]
@@ -190,38 +241,36 @@ def get_budget_tags(selected_budget):
     return all_budgets
 
 
-@app.route('/')
-def index():
-    return render_template('index.html')
+PROFILE_TAGS = ('gender', 'age', 'relationship', 'occasion')
+NUMERIC_TAGS = ('gift_experience', 'gift_daily_use', 'gift_aesthetic')
 
 
-@app.route('/quiz')
-def quiz():
-    # Создаём сессию аналитики
-    session_id = create_session(source="web")
-    session['analytics_session_id'] = session_id
-    save_event(session_id, "quiz_start")
-    
-    return render_template('quiz.html', questions=QUESTIONS)
+def parse_weight(value) -> float:
+    """Вес из ответа квиза; ValueError — если это не конечное число"""
+    try:
+        weight = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid weight: {value!r}")
+    if not math.isfinite(weight):
+        raise ValueError(f"Invalid weight: {value!r}")
+    return weight
 
 
-@app.route('/api/interests')
-def get_interests():
-    gender = request.args.get('gender', 'gender_male')
-    age = request.args.get('age', 'age_26_35')
+def parse_answers(data: dict):
+    """
+    Превращает ответы квиза в (filters, value_weights, interest_weights).
     
-    if age == 'age_65plus':
-        return jsonify(INTERESTS_ELDERLY)
-    elif gender == 'gender_female':
-        return jsonify(INTERESTS_FEMALE)
-    else:
-        return jsonify(INTERESTS_MALE)
-
-
-@app.route('/api/results', methods=['POST'])
-def get_results():
-    data = request.json
-    session_id = session.get('analytics_session_id')
+    ValueError — если ответы не той формы: такие запросы отклоняются с 400,
+    а не доходят до записи в аналитику.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Invalid request body")
+    answers = data.get('answers', [])
+    interests = data.get('interests', [])
+    if not isinstance(answers, list) or not all(isinstance(answer, dict) for answer in answers):
+        raise ValueError("Invalid answers")
+    if not isinstance(interests, list) or not all(isinstance(interest, str) for interest in interests):
+        raise ValueError("Invalid interests")
     
     # Формируем фильтры
     filters = {}
@@ -235,16 +284,20 @@ def get_results():
     interest_weights = {}
     
     # Обрабатываем ответы
-    for answer in data.get('answers', []):
+    for answer in answers:
         tag = answer.get('tag')
         value = answer.get('value')
         
         if tag == 'budget':
+            if not isinstance(value, str):
+                raise ValueError("Invalid budget")
             filters['budget'] = get_budget_tags(value)
-        elif tag in ['gender', 'age', 'relationship', 'occasion']:
+        elif tag in PROFILE_TAGS:
+            if not isinstance(value, str):
+                raise ValueError(f"Invalid {tag}")
             filters[tag] = value
-        elif tag == 'gift_experience':
-            value_weights['gift_experience'] = float(value)
+        elif tag in NUMERIC_TAGS:
+            value_weights[tag] = parse_weight(value)
         elif tag == 'practical_emotional':
             if value == 'practical':
                 value_weights['gift_practical'] = 1.0
@@ -252,34 +305,259 @@ def get_results():
             elif value == 'emotional':
                 value_weights['gift_practical'] = 0.0
                 value_weights['gift_emotional'] = 1.0
-        elif tag == 'gift_daily_use':
-            value_weights['gift_daily_use'] = float(value)
-        elif tag == 'gift_aesthetic':
-            value_weights['gift_aesthetic'] = float(value)
     
     # Обрабатываем интересы
-    interests_list = data.get('interests', [])
-    for interest in interests_list:
+    for interest in interests:
         interest_weights[interest] = 1.0
     
+    return filters, value_weights, interest_weights
+
+
+def get_analytics_session_id(create: bool = False):
+    """
+    Возвращает session_id аналитики.
+    
+    Сессия и событие quiz_start пишутся в базу только при первом реальном
+    действии (create=True) — с временем открытия квиза.
+    """
+    session_id = session.get('analytics_session_id')
+    
+    if session_id is None and create and 'quiz_started_at' in session:
+        started_at = session.pop('quiz_started_at')
+        session_id = create_session(source="web", created_at=started_at)
+        session['analytics_session_id'] = session_id
+        queue_event(session_id, "quiz_start", created_at=started_at)
+    
+    return session_id
+
+
+# ============== МЕТРИКИ ==============
+
+request_seconds = metrics.histogram("gift_request_seconds", "Время обработки запроса")
+requests_total = metrics.counter("gift_requests_total", "Число запросов")
+
+metrics.gauge(
+    "gift_results_cache", "Счётчики кэша результатов",
+    lambda: [((("stat", name),), value) for name, value in results_cache.stats().items()]
+)
+metrics.gauge(
+    "gift_analytics_writer", "Счётчики фоновой записи аналитики",
+    lambda: [((("stat", name),), value) for name, value in writer.stats().items()]
+)
+metrics.gauge(
+    "gift_collaborative_snapshot", "Снимок коллаборативных оценок",
+    lambda: [((("stat", name),), value) for name, value in collaborative.snapshot.stats().items()]
+)
+
+
+@app.before_request
+def start_timing():
+    g.request_started = time.perf_counter()
+    metrics.start_request()
+
+
+@app.after_request
+def finish_timing(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    
+    # Метка — шаблон маршрута, чтобы число рядов не зависело от URL
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    request_seconds.observe(time.perf_counter() - started, endpoint=endpoint)
+    requests_total.inc(endpoint=endpoint, status=response.status_code)
+    
+    if SERVER_TIMING:
+        timings = dict(metrics.request_timings())
+        timings['total'] = time.perf_counter() - started
+        response.headers['Server-Timing'] = metrics.server_timing_header(timings)
+    
+    return response
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Метрики текущего воркера в формате Prometheus"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+def get_ranking(filters: dict, value_weights: dict, interest_weights: dict) -> list:
+    """Рейтинг подарков (сначала из кэша по нормализованным ответам)"""
+    cache_key = make_key(filters, value_weights, interest_weights)
+    catalog_version = get_catalog().version
+    with metrics.timed("cache"):
+        gifts = results_cache.get(cache_key, catalog_version)
+    if gifts is None:
+        gifts = get_top_gifts(filters, value_weights, interest_weights, limit=RESULTS_LIMIT)
+        results_cache.put(cache_key, gifts, catalog_version)
+    return gifts
+
+
+class StaleCursor(Exception):
+    """Рейтинг изменился с тех пор, как выдан курсор"""
+
+
+def ranking_fingerprint(gifts: list) -> str:
+    """Отпечаток порядка рейтинга: курсор следующей страницы годится только для него"""
+    order = ','.join(str(gift['id']) for gift in gifts)
+    return hashlib.blake2b(order.encode('ascii'), digest_size=8).hexdigest()
+
+
+def encode_cursor(filters: dict, value_weights: dict, interests: list,
+                  offset: int, page_size: int, compact: bool, fingerprint: str) -> str:
+    """
+    Курсор следующей страницы: ответы квиза, смещение и отпечаток рейтинга в base64.
+    
+    Курсор не подписан — по нему только пересчитывается рейтинг для тех же
+    ответов, что клиент и так может прислать в /api/results.
+    """
+    payload = json.dumps(
+        [filters, value_weights, sorted(interests, key=str), offset, page_size, int(compact), fingerprint],
+        separators=(',', ':'), ensure_ascii=False
+    )
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def valid_cursor_answers(filters, value_weights, interests) -> bool:
+    """Ответы из курсора той же формы, что выдаёт parse_answers"""
+    if not (isinstance(filters, dict) and isinstance(value_weights, dict) and isinstance(interests, list)):
+        return False
+    for tag, value in filters.items():
+        if tag == 'budget':
+            if not (isinstance(value, list) and all(isinstance(b, str) and b in BUDGET_ORDER for b in value)):
+                return False
+        elif tag not in PROFILE_TAGS or not isinstance(value, str):
+            return False
+    return (all(isinstance(i, str) for i in interests)
+            and all(isinstance(w, (int, float)) and not isinstance(w, bool) and math.isfinite(w)
+                    for w in value_weights.values()))
+
+
+def decode_cursor(cursor: str):
+    """Разбирает курсор, ValueError — если он испорчен"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        filters, value_weights, interests, offset, page_size, compact, fingerprint = json.loads(raw)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    
+    if not valid_cursor_answers(filters, value_weights, interests) or not isinstance(fingerprint, str):
+        raise ValueError("Invalid cursor")
+    if not (isinstance(offset, int) and 0 <= offset <= RESULTS_LIMIT
+            and isinstance(page_size, int) and 1 <= page_size <= MAX_PAGE_SIZE):
+        raise ValueError("Invalid cursor")
+    
+    return filters, value_weights, interests, offset, page_size, bool(compact), fingerprint
+
+
+def results_page(filters: dict, value_weights: dict, interests: list,
+                 offset: int, page_size: int, compact: bool, fingerprint: str = None) -> dict:
+    """
+    Страница рейтинга и курсор следующей.
+    
+    Следующие страницы пересчитываются из кэша своего воркера, а рейтинг
+    между воркерами (снимок коллаборативных оценок, вытеснение из кэша) может
+    разойтись. Если отпечаток из курсора не совпал, StaleCursor — иначе
+    клиент получил бы повторы и пропуски.
+    """
+    interest_weights = {interest: 1.0 for interest in interests}
+    gifts = get_ranking(filters, value_weights, interest_weights)
+    
+    current = ranking_fingerprint(gifts)
+    if fingerprint is not None and fingerprint != current:
+        raise StaleCursor("Ranking changed")
+    
+    page = gifts[offset:offset + page_size]
+    if compact:
+        # Описание подгружается при раскрытии карточки (/api/gifts/<id>/description)
+        page = [{k: v for k, v in gift.items() if k != 'description'} for gift in page]
+    
+    next_offset = offset + page_size
+    next_cursor = None
+    if next_offset < len(gifts):
+        next_cursor = encode_cursor(filters, value_weights, interests, next_offset, page_size,
+                                    compact, current)
+    
+    return {'gifts': page, 'total': len(gifts), 'next_cursor': next_cursor}
+
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+
+@app.route('/quiz')
+def quiz():
+    # Сессию аналитики создадим при первом действии — здесь только запоминаем время
+    session.pop('analytics_session_id', None)
+    session['quiz_started_at'] = utc_now()
+    
+    return render_template('quiz.html', questions_json=QUESTIONS_JSON)
+
+
+@app.route('/api/questions')
+def get_questions():
+    return QUESTIONS_PAYLOAD.response(request)
+
+
+@app.route('/api/interests')
+def get_interests():
+    gender = request.args.get('gender', 'gender_male')
+    age = request.args.get('age', 'age_26_35')
+    
+    return INTERESTS_PAYLOADS[interests_group(gender, age)].response(request)
+
+
+@app.route('/api/results', methods=['POST'])
+@profile_slow_requests
+def get_results():
+    data = request.get_json(silent=True)
+    try:
+        filters, value_weights, interest_weights = parse_answers(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    session_id = get_analytics_session_id(create=True)
+    interests_list = data.get('interests', [])
+    set_profile_tags(filters=filters, value_weights=value_weights, interests=interests_list)
+    
+    # refresh — клиент перезапрашивает рейтинг после 409 от /api/results/page:
+    # ответы те же, в аналитику их второй раз не пишем
+    track = session_id and not data.get('refresh')
+    
     # Сохраняем ответы в аналитику
-    if session_id:
-        save_answers(
+    if track:
+        queue_answers(
             session_id=session_id,
             filters=filters,
             value_weights=value_weights,
             interests=interests_list
         )
-        save_event(session_id, "results_requested")
+        queue_event(session_id, "results_requested")
     
     # Сохраняем session_id в ответе для использования при оценках
     session['filters'] = filters
     
-    # Получаем результаты
-    gifts = get_top_gifts(filters, value_weights, interest_weights, limit=100)
+    # С page_size — первая страница и курсор, иначе весь рейтинг сразу
+    page_size = data.get('page_size')
+    if page_size is not None:
+        try:
+            page_size = min(max(int(page_size), 1), MAX_PAGE_SIZE)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid page_size'}), 400
+        
+        result = results_page(filters, value_weights, interests_list, 0, page_size,
+                              bool(data.get('compact')))
+        if track:
+            queue_event(session_id, "results_loaded", {"count": result['total']})
+        
+        result['session_id'] = session_id
+        return jsonify(result)
     
-    if session_id:
-        save_event(session_id, "results_loaded", {"count": len(gifts)})
+    gifts = get_ranking(filters, value_weights, interest_weights)
+    
+    if track:
+        queue_event(session_id, "results_loaded", {"count": len(gifts)})
     
     return jsonify({
         'gifts': gifts,
@@ -287,23 +565,62 @@ def get_results():
     })
 
 
+@app.route('/api/results/page')
+def get_results_page():
+    """Следующая страница рейтинга по курсору из предыдущего ответа"""
+    try:
+        filters, value_weights, interests, offset, page_size, compact, fingerprint = decode_cursor(
+            request.args.get('cursor', '')
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    try:
+        return jsonify(results_page(filters, value_weights, interests, offset, page_size,
+                                    compact, fingerprint))
+    except StaleCursor:
+        # Рейтинг изменился — клиент запрашивает его заново через /api/results
+        return jsonify({'error': 'Stale cursor'}), 409
+
+
+@app.route('/api/gifts/<int:gift_id>/description')
+def gift_description(gift_id):
+    """Описание подарка для раскрытой карточки"""
+    gift = get_catalog().by_id.get(gift_id)
+    if gift is None:
+        return jsonify({'error': 'Not found'}), 404
+    
+    return jsonify({'id': gift.id, 'description': gift.description})
+
+
 @app.route('/api/rate', methods=['POST'])
 def rate_gift():
     """Сохраняет оценку подарка"""
-    data = request.json
-    session_id = session.get('analytics_session_id')
-    
-    if not session_id:
-        return jsonify({'error': 'No session'}), 400
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid rating'}), 400
     
     gift_id = data.get('gift_id')
     gift_name = data.get('gift_name')
     rating = data.get('rating')  # 1 = like, -1 = dislike
     
-    save_rating(session_id, gift_id, gift_name, rating)
+    # Плохая строка в пачке фоновой записи откатила бы оценки других пользователей
+    if (isinstance(gift_id, bool) or not isinstance(gift_id, int)
+            or get_catalog().by_id.get(gift_id) is None):
+        return jsonify({'error': 'Invalid gift_id'}), 400
+    if isinstance(rating, bool) or rating not in (1, -1):
+        return jsonify({'error': 'Invalid rating'}), 400
+    if gift_name is not None and not isinstance(gift_name, str):
+        return jsonify({'error': 'Invalid gift_name'}), 400
+    
+    session_id = get_analytics_session_id(create=True)
+    if not session_id:
+        return jsonify({'error': 'No session'}), 400
+    
+    queue_rating(session_id, gift_id, gift_name, rating)
     
     event_type = "like" if rating == 1 else "dislike"
-    save_event(session_id, event_type, {"gift_id": gift_id, "gift_name": gift_name})
+    queue_event(session_id, event_type, {"gift_id": gift_id, "gift_name": gift_name})
     
     return jsonify({'success': True})
 
@@ -311,14 +628,20 @@ def rate_gift():
 @app.route('/api/complete', methods=['POST'])
 def complete():
     """Завершает сессию"""
-    session_id = session.get('analytics_session_id')
+    session_id = get_analytics_session_id()
     
     if session_id:
-        complete_session(session_id)
-        save_event(session_id, "completed")
+        queue_complete_session(session_id)
+        queue_event(session_id, "completed")
     
     return jsonify({'success': True})
 
 
+@app.route('/api/cache/stats')
+def cache_stats():
+    """Счётчики кэша результатов"""
+    return jsonify(results_cache.stats())
+
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
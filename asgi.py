@@ -0,0 +1,154 @@
+"""
+ASGI-режим: то же Flask-приложение за асинхронным сервером.
+
+Цикл событий принимает соединения (в том числе keep-alive и медленных
+клиентов), а сами запросы со всеми блокирующими вызовами SQLite выполняются
+в пуле из ASGI_THREADS потоков. У каждого потока пула своё долгоживущее
+соединение с базами (db.py), запись аналитики и так идёт фоновым потоком
+(analytics.AnalyticsWriter).
+
+asgiref.WsgiToAsgi не подходит: он выполняет все запросы одного процесса
+в единственном потоке.
+
+uvicorn не входит в requirements.txt — ставится отдельно:
+
+    pip install -r requirements-asgi.txt
+    uvicorn asgi:application --workers 2
+    gunicorn asgi:application -k uvicorn.workers.UvicornWorker
+
+WSGI-вход (gunicorn app:app) работает как раньше.
+"""
+import asyncio
+import contextvars
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app
+
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS", "32"))
+
+
+def build_environ(scope: dict, body: bytes) -> dict:
+    """WSGI environ из ASGI scope (PEP 3333)"""
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+
+    server = scope.get("server") or ("localhost", 80)
+    environ["SERVER_NAME"] = server[0]
+    environ["SERVER_PORT"] = str(server[1] or 80)
+    client = scope.get("client")
+    if client:
+        environ["REMOTE_ADDR"] = client[0]
+        environ["REMOTE_PORT"] = str(client[1])
+
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1")
+        if name == "content-length":
+            key = "CONTENT_LENGTH"
+        elif name == "content-type":
+            key = "CONTENT_TYPE"
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if key in environ:
+            value = environ[key] + "," + value
+        environ[key] = value
+
+    return environ
+
+
+def call_wsgi(wsgi_app, environ: dict):
+    """Выполняет WSGI-приложение целиком, возвращает (status, headers, body)"""
+    response = []
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and response:
+            raise exc_info[1].with_traceback(exc_info[2])
+        response[:] = [status, headers]
+        return chunks.append
+
+    result = wsgi_app(environ, start_response)
+    try:
+        for chunk in result:
+            if chunk:
+                chunks.append(chunk)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+    status, headers = response
+    return int(status.split(" ", 1)[0]), headers, b"".join(chunks)
+
+
+class WsgiToAsgi:
+    """ASGI-обёртка WSGI-приложения с пулом потоков"""
+
+    def __init__(self, wsgi_app, threads: int = ASGI_THREADS):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi-worker")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            raise ValueError(f"Неподдерживаемый тип ASGI scope: {scope['type']}")
+
+        body = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+
+        environ = build_environ(scope, b"".join(body))
+
+        # Свежий контекст на запрос: contextvars не переходят между запросами потока
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        status, headers, content = await loop.run_in_executor(
+            self.executor, context.run, call_wsgi, self.wsgi_app, environ
+        )
+
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                        for name, value in headers],
+        })
+        await send({"type": "http.response.body", "body": content})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+application = WsgiToAsgi(app)
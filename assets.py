@@ -0,0 +1,66 @@
+"""
+Версионированные URL статики.
+
+url_for('static', filename=...) добавляет ?v=<хэш содержимого>. Запрос с
+актуальной версией отдаётся с Cache-Control: immutable на год — браузер
+не перепроверяет файл, а после изменения файла меняется и URL.
+"""
+import hashlib
+import os
+import threading
+
+from flask import request
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# filename -> (mtime, size, версия)
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def asset_version(static_folder: str, filename: str):
+    """Короткий хэш содержимого файла или None, если файла нет"""
+    path = os.path.join(static_folder, filename)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    cached = _versions.get(filename)
+    if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+        return cached[2]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    version = digest.hexdigest()[:12]
+
+    with _versions_lock:
+        _versions[filename] = (stat.st_mtime, stat.st_size, version)
+    return version
+
+
+def init_app(app):
+    """Подключает версии к url_for и заголовки кэширования к ответам static"""
+
+    @app.url_defaults
+    def add_static_version(endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            version = asset_version(app.static_folder, values['filename'])
+            if version:
+                values['v'] = version
+
+    @app.after_request
+    def cache_static(response):
+        if request.endpoint != 'static' or response.status_code not in (200, 304):
+            return response
+
+        version = request.args.get('v')
+        filename = (request.view_args or {}).get('filename')
+        if version and filename and version == asset_version(app.static_folder, filename):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        return response
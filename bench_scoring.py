@@ -0,0 +1,353 @@
+"""
+Бенчмарк пути /api/results: get_top_gifts + коллаборативные бонусы.
+
+Генерирует синтетические каталоги gifts.db (словарь тегов берётся из
+app.QUESTIONS и списков INTERESTS_*) и истории analytics.db, затем прогоняет
+по каждой конфигурации набор типичных ответов квиза. Печатает p50/p99,
+пропускную способность и пиковую память; с --json сохраняет результат
+в машиночитаемом виде, чтобы сравнивать коммиты.
+
+    python bench_scoring.py
+    python bench_scoring.py --gifts 1000,10000 --ratings 10000,1000000 --json bench.json
+    python bench_scoring.py --ratings 10000000 --backend python,numpy
+    python bench_scoring.py --ranking-table     # с таблицей ранжирования (ranking_table.py)
+    python bench_scoring.py --mmap              # каталог из catalog.bin (catalog_mmap.py)
+
+Перед замерами запросов печатается время загрузки каталога каждого размера
+(GiftCatalog.load и отдельно build_tag_index).
+"""
+import argparse
+import importlib
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import analytics
+import catalog
+import catalog_mmap
+import ranking_table
+import scoring
+from db import close_connection
+from metrics import percentile
+from app import QUESTIONS, INTERESTS_BY_GROUP, interests_for, parse_answers
+
+VALUE_TAGS = ["gift_practical", "gift_emotional", "gift_experience", "gift_daily_use",
+              "gift_aesthetic", "gift_unique", "gift_memory", "gift_luxury",
+              "gift_surprise", "gift_romantic", "gift_practical_life"]
+
+
+def question_values(tag: str) -> list:
+    for q in QUESTIONS:
+        if q['tag'] == tag:
+            return [opt['value'] for opt in q['options']]
+    return []
+
+
+def all_interests() -> list:
+    seen = []
+    for options in INTERESTS_BY_GROUP.values():
+        for opt in options:
+            if opt['value'] not in seen:
+                seen.append(opt['value'])
+    return seen
+
+
+# ============== ГЕНЕРАЦИЯ ДАННЫХ ==============
+
+def generate_gifts_db(path: str, count: int, seed: int):
+    """Каталог из count подарков со случайными, но правдоподобными тегами"""
+    rng = random.Random(seed)
+    budgets = question_values('budget')
+    genders = question_values('gender')
+    ages = question_values('age')
+    relationships = question_values('relationship')
+    occasions = question_values('occasion')
+    interests = all_interests()
+
+    def some(values, low, high):
+        return rng.sample(values, rng.randint(low, min(high, len(values))))
+
+    rows = []
+    for gift_id in range(1, count + 1):
+        start = rng.randrange(len(budgets))
+        end = rng.randrange(start, len(budgets))
+        value_tags = {tag: round(rng.uniform(0.1, 1.0), 1) for tag in some(VALUE_TAGS, 2, 5)}
+        interest_tags = {tag: round(rng.uniform(0.3, 1.0), 1) for tag in some(interests, 1, 4)}
+        rows.append((
+            gift_id,
+            f"Подарок {gift_id}",
+            f"{rng.randint(1, 50) * 1000:,}₽",
+            "Синтетическое описание подарка для бенчмарка. " * 4,
+            ", ".join(budgets[start:end + 1]),
+            ", ".join(some(genders, 1, 2)),
+            ", ".join(some(ages, 2, 6)),
+            ", ".join(some(relationships, 2, 6)),
+            ", ".join(some(occasions, 2, 6)),
+            ", ".join(f"{tag}:{value}" for tag, value in value_tags.items()),
+            ", ".join(f"{tag}:{value}" for tag, value in interest_tags.items()),
+        ))
+
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE gifts (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            price TEXT,
+            description TEXT,
+            budget_tags TEXT,
+            gender_tags TEXT,
+            age_tags TEXT,
+            relationship_tags TEXT,
+            occasion_tags TEXT,
+            value_tags TEXT,
+            interest_tags TEXT
+        )
+    ''')
+    conn.executemany('INSERT INTO gifts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+
+
+def generate_analytics_db(path: str, ratings: int, gift_count: int, seed: int):
+    """История: ~5 оценок на сессию, профили сессий — случайные ответы квиза"""
+    rng = random.Random(seed)
+    genders = question_values('gender')
+    ages = question_values('age')
+    relationships = question_values('relationship')
+    occasions = question_values('occasion')
+    sessions = max(ratings // 5, 1)
+
+    analytics.DB_PATH = path
+    analytics.init_db()
+
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=OFF')
+
+    chunk = 100000
+    for first in range(1, sessions + 1, chunk):
+        ids = range(first, min(first + chunk, sessions + 1))
+        conn.executemany('INSERT INTO sessions (id, source) VALUES (?, ?)', ((i, 'bench') for i in ids))
+        conn.executemany(
+            'INSERT INTO answers (session_id, gender, age, relationship, occasion) VALUES (?, ?, ?, ?, ?)',
+            ((i, rng.choice(genders), rng.choice(ages), rng.choice(relationships), rng.choice(occasions))
+             for i in ids)
+        )
+    for first in range(0, ratings, chunk):
+        size = min(chunk, ratings - first)
+        conn.executemany(
+            'INSERT INTO ratings (session_id, gift_id, gift_name, rating) VALUES (?, ?, ?, ?)',
+            ((rng.randint(1, sessions), rng.randint(1, gift_count), None, rng.choice((1, -1)))
+             for _ in range(size))
+        )
+    conn.commit()
+    conn.close()
+
+    analytics.rebuild_profile_gift_stats()
+    close_connection(path)
+
+
+def ensure_db(workdir: str, name: str, generate, *args) -> str:
+    """Генерирует базу один раз и переиспользует её при следующих запусках"""
+    path = os.path.join(workdir, name)
+    if not os.path.exists(path):
+        started = time.perf_counter()
+        generate(path + ".tmp", *args)
+        os.replace(path + ".tmp", path)
+        print(f"   сгенерирована {name} за {time.perf_counter() - started:.1f} с")
+    return path
+
+
+# ============== ЗАПРОСЫ ==============
+
+def make_queries(count: int, seed: int) -> list:
+    """Смесь ответов квиза: все вопросы + 0-4 интереса из подходящего списка"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        answers = [{'tag': q['tag'], 'value': rng.choice(q['options'])['value']} for q in QUESTIONS]
+        data = {'answers': answers}
+        filters, _, _ = parse_answers(data)
+        options = interests_for(filters.get('gender'), filters.get('age'))
+        data['interests'] = [opt['value'] for opt in rng.sample(options, rng.randint(0, 4))]
+        queries.append(parse_answers(data))
+    return queries
+
+
+def bench_catalog_load(gifts_path: str, repeat: int) -> dict:
+    """
+    Загрузка каталога из gifts.db — её платит каждый воркер при смене mtime.
+    Медианы по repeat повторам: вся загрузка и отдельно инвертированный индекс.
+    """
+    load_latencies = []
+    index_latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        loaded = catalog.GiftCatalog.load(gifts_path)
+        load_latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        catalog.build_tag_index(loaded.gifts)
+        index_latencies.append(time.perf_counter() - started)
+
+    return {
+        'gifts': len(loaded),
+        'load_ms': round(percentile(load_latencies, 50) * 1000, 1),
+        'tag_index_ms': round(percentile(index_latencies, 50) * 1000, 1),
+    }
+
+
+def run_config(gifts_path: str, analytics_path: str, queries: list, backend: str, limit: int,
+               ranking_path: str = None, mmap_path: str = None) -> dict:
+    catalog.DB_PATH = gifts_path
+    scoring.ANALYTICS_DB_PATH = analytics_path
+    ranking_table.RANKING_TABLE_PATH = ranking_path or ""
+    catalog_mmap.CATALOG_MMAP_PATH = mmap_path or ""
+    catalog.reset_catalog()
+
+    if backend == "numpy":
+        importlib.import_module("scoring_numpy")  # импорт numpy не должен попадать в замер памяти
+
+    started = time.perf_counter()
+    catalog.get_catalog()
+    load_seconds = time.perf_counter() - started
+
+    # Пиковая память: повторная загрузка каталога + несколько запросов под tracemalloc
+    catalog.reset_catalog()
+    tracemalloc.start()
+    catalog.get_catalog()
+    for filters, value_weights, interest_weights in queries[:10]:
+        scoring.get_top_gifts(filters, value_weights, interest_weights, limit, backend=backend)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Задержки без tracemalloc
+    total_latencies = []
+    collaborative_latencies = []
+    started = time.perf_counter()
+    for filters, value_weights, interest_weights in queries:
+        t0 = time.perf_counter()
+        scoring.get_collaborative_scores(filters)
+        t1 = time.perf_counter()
+        scoring.get_top_gifts(filters, value_weights, interest_weights, limit, backend=backend)
+        t2 = time.perf_counter()
+        collaborative_latencies.append(t1 - t0)
+        total_latencies.append(t2 - t1)
+    elapsed = time.perf_counter() - started
+
+    return {
+        'catalog_load_ms': round(load_seconds * 1000, 2),
+        'p50_ms': round(percentile(total_latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(total_latencies, 99) * 1000, 3),
+        'collaborative_p50_ms': round(percentile(collaborative_latencies, 50) * 1000, 3),
+        'collaborative_p99_ms': round(percentile(collaborative_latencies, 99) * 1000, 3),
+        'throughput_rps': round(len(queries) / sum(total_latencies), 1),
+        'wall_seconds': round(elapsed, 3),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def parse_sizes(value: str) -> list:
+    return [int(float(part)) for part in value.split(',') if part]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк scoring на синтетических данных")
+    parser.add_argument('--gifts', type=parse_sizes, default=[1000, 10000, 100000],
+                        help="размеры каталога через запятую")
+    parser.add_argument('--ratings', type=parse_sizes, default=[10000, 1000000],
+                        help="размеры истории оценок через запятую (до 10000000)")
+    parser.add_argument('--queries', type=int, default=200, help="запросов на конфигурацию")
+    parser.add_argument('--limit', type=int, default=100, help="limit для get_top_gifts")
+    parser.add_argument('--backend', default="python", help="бэкенды scoring через запятую")
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), "gift-bench"),
+                        help="куда сохранять сгенерированные базы")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--ranking-table', action='store_true',
+                        help="собрать и использовать таблицу ранжирования")
+    parser.add_argument('--mmap', action='store_true',
+                        help="экспортировать и загружать каталог из catalog.bin")
+    parser.add_argument('--load-repeat', type=int, default=3,
+                        help="повторов замера загрузки каталога")
+    parser.add_argument('--json', dest='json_path', help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    queries = make_queries(args.queries, args.seed)
+    backends = [b for b in args.backend.split(',') if b]
+
+    catalog_loads = []
+    print(f"{'gifts':>8} {'load ms':>9} {'index ms':>9}")
+    for gift_count in args.gifts:
+        gifts_path = ensure_db(args.workdir, f"gifts_{gift_count}_{args.seed}.db",
+                               generate_gifts_db, gift_count, args.seed)
+        load = bench_catalog_load(gifts_path, args.load_repeat)
+        catalog_loads.append(load)
+        print(f"{gift_count:>8} {load['load_ms']:>9} {load['tag_index_ms']:>9}")
+    print()
+
+    results = []
+    print(f"{'gifts':>8} {'ratings':>10} {'backend':>8} {'p50 ms':>9} {'p99 ms':>9} "
+          f"{'collab p99':>10} {'rps':>8} {'peak KB':>10}")
+
+    for gift_count in args.gifts:
+        gifts_path = ensure_db(args.workdir, f"gifts_{gift_count}_{args.seed}.db",
+                               generate_gifts_db, gift_count, args.seed)
+        mmap_path = None
+        if args.mmap:
+            mmap_path = gifts_path[:-len(".db")] + ".catalog.bin"
+            if not os.path.exists(mmap_path) or catalog_mmap.read_version(mmap_path) != os.path.getmtime(gifts_path):
+                catalog_mmap.export(gifts_path, mmap_path)
+
+        ranking_path = None
+        if args.ranking_table:
+            catalog.DB_PATH = gifts_path
+            catalog_mmap.CATALOG_MMAP_PATH = mmap_path or ""
+            catalog.reset_catalog()
+            ranking_path = gifts_path[:-len(".db")] + ".ranking.bin"
+            if not os.path.exists(ranking_path):
+                ranking_table.build(catalog.get_catalog(), ranking_path)
+        for rating_count in args.ratings:
+            analytics_path = ensure_db(args.workdir, f"analytics_{rating_count}_{gift_count}_{args.seed}.db",
+                                       generate_analytics_db, rating_count, gift_count, args.seed)
+            for backend in backends:
+                result = run_config(gifts_path, analytics_path, queries, backend, args.limit,
+                                    ranking_path, mmap_path)
+                result.update({'gifts': gift_count, 'ratings': rating_count, 'backend': backend,
+                               'ranking_table': bool(ranking_path), 'mmap': bool(mmap_path)})
+                results.append(result)
+                print(f"{gift_count:>8} {rating_count:>10} {backend:>8} {result['p50_ms']:>9} "
+                      f"{result['p99_ms']:>9} {result['collaborative_p99_ms']:>10} "
+                      f"{result['throughput_rps']:>8} {result['peak_memory_kb']:>10}")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'python': sys.version.split()[0],
+                'queries': args.queries,
+                'limit': args.limit,
+                'seed': args.seed,
+                'catalog_load': catalog_loads,
+                'results': results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ Результаты сохранены в {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import os
+import sqlite3
+import sys
+import threading
+from dataclasses import dataclass
+from operator import attrgetter
+
+from metrics import timed
+
+DB_PATH = "gifts.db"
+
+# Порядок бюджетов
+BUDGET_ORDER = ["budget_2000", "budget_5000", "budget_10000", "budget_15000",
+                "budget_20000", "budget_30000", "budget_50000", "budget_100000"]
+
+# PRIMARY теги, по которым строится инвертированный индекс
+PRIMARY_FIELDS = ("budget", "gender", "age", "relationship", "occasion")
+
+# Виды весов в таблице gift_weights: kind -> поле CatalogGift
+WEIGHT_KINDS = ("value", "interest")
+
+# Номера установленных битов для каждого значения байта
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+
+@dataclass(frozen=True, slots=True)
+class CatalogGift:
+    """Подарок с уже разобранными тегами"""
+    id: int
+    name: str
+    price: str
+    description: str
+    budget: frozenset
+    gender: frozenset
+    age: frozenset
+    relationship: frozenset
+    occasion: frozenset
+    budget_min: int  # индекс в BUDGET_ORDER, -1 если бюджет не указан
+    budget_max: int
+    values: dict     # {'gift_practical': 1.0, ...}
+    interests: dict  # {'interest_tech': 0.8, ...}
+
+
+def parse_tag_set(tags_str) -> frozenset:
+    """'a, b, c' -> frozenset({'a', 'b', 'c'})"""
+    return frozenset(
+        part.strip() for part in str(tags_str or '').split(',') if part.strip()
+    )
+
+
+def parse_tag_weights(tags_str) -> dict:
+    """'gift_practical:1.0, gift_emotional:0.6' -> {'gift_practical': 1.0, ...}"""
+    weights = {}
+    for part in str(tags_str or '').split(','):
+        if ':' not in part:
+            continue
+        tag, _, value = part.partition(':')
+        tag = tag.strip()
+        if not tag or tag in weights:
+            continue
+        try:
+            weights[tag] = float(value)
+        except ValueError:
+            pass
+    return weights
+
+
+def budget_range(budget_tags: frozenset) -> tuple:
+    """Возвращает (min, max) индексы бюджета подарка в BUDGET_ORDER"""
+    indices = [i for i, tag in enumerate(BUDGET_ORDER) if tag in budget_tags]
+    if not indices:
+        return -1, -1
+    return min(indices), max(indices)
+
+
+def bitmap_positions(bitmap: int, size: int) -> list:
+    """Возвращает номера установленных битов по возрастанию"""
+    positions = []
+    data = bitmap.to_bytes((size + 7) // 8, "little")
+    for byte_index, byte in enumerate(data):
+        if byte:
+            base = byte_index * 8
+            positions.extend(base + bit for bit in _BYTE_BITS[byte])
+    return positions
+
+
+def build_tag_index(gifts: list) -> dict:
+    """
+    Инвертированный индекс {поле: {тег: битмап}} по PRIMARY тегам.
+
+    Бит i битмапа установлен, если у gifts[i] есть этот тег.
+    """
+    # Биты ставятся в bytearray, int собирается один раз на тег: OR в большое
+    # число по одному подарку копирует его целиком и даёт квадратичное время
+    size = (len(gifts) + 7) // 8
+    index = {}
+    for field in PRIMARY_FIELDS:
+        bitmaps = {}
+        for position, tags in enumerate(map(attrgetter(field), gifts)):
+            byte, bit = position >> 3, 1 << (position & 7)
+            for tag in tags:
+                data = bitmaps.get(tag)
+                if data is None:
+                    data = bitmaps[tag] = bytearray(size)
+                data[byte] |= bit
+        index[field] = {tag: int.from_bytes(data, "little") for tag, data in bitmaps.items()}
+    return index
+
+
+def gift_from_row(row, weights: dict = None) -> CatalogGift:
+    """
+    Разбирает строку таблицы gifts.
+
+    weights — {kind: {тег: вес}} из gift_weights; без них веса разбираются
+    из value_tags / interest_tags.
+    """
+    if weights is None:
+        weights = {'value': parse_tag_weights(row[9]), 'interest': parse_tag_weights(row[10])}
+    budget = parse_tag_set(row[4])
+    budget_min, budget_max = budget_range(budget)
+    return CatalogGift(
+        id=row[0],
+        name=row[1],
+        price=row[2],
+        description=row[3],
+        budget=budget,
+        gender=parse_tag_set(row[5]),
+        age=parse_tag_set(row[6]),
+        relationship=parse_tag_set(row[7]),
+        occasion=parse_tag_set(row[8]),
+        budget_min=budget_min,
+        budget_max=budget_max,
+        values=weights.get('value', {}),
+        interests=weights.get('interest', {}),
+    )
+
+
+def load_weight_table(conn: sqlite3.Connection):
+    """
+    Веса из gift_weights: {gift_id: {kind: {тег: вес}}}.
+
+    None, если миграция gift_weights.py не запускалась.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'gift_weights'"
+    ).fetchone()
+    if not exists:
+        return None
+
+    table = {}
+    for gift_id, kind, tag, weight in conn.execute(
+            'SELECT gift_id, kind, tag, weight FROM gift_weights'):
+        table.setdefault(gift_id, {}).setdefault(kind, {})[tag] = weight
+    return table
+
+
+class GiftCatalog:
+    """Каталог подарков, загруженный в память"""
+
+    def __init__(self, gifts: list, version: float = 0.0):
+        self.gifts = gifts
+        self.version = version
+        self.by_id = {gift.id: gift for gift in gifts}
+        self.tag_index = build_tag_index(gifts)
+        self.all_bitmap = (1 << len(gifts)) - 1
+
+    def __len__(self):
+        return len(self.gifts)
+
+    def candidate_bitmap(self, filters: dict) -> int:
+        """Пересечение битмапов PRIMARY фильтров (бюджет — объединение допустимых)"""
+        bitmap = self.all_bitmap
+
+        if 'budget' in filters:
+            budget_index = self.tag_index['budget']
+            budget_bitmap = 0
+            for tag in filters['budget']:
+                budget_bitmap |= budget_index.get(tag, 0)
+            bitmap &= budget_bitmap
+
+        for field in PRIMARY_FIELDS[1:]:
+            if field in filters:
+                bitmap &= self.tag_index[field].get(filters[field], 0)
+            if not bitmap:
+                break
+
+        return bitmap
+
+    def candidates(self, filters: dict) -> list:
+        """Подарки, прошедшие PRIMARY фильтрацию, в порядке каталога"""
+        positions = bitmap_positions(self.candidate_bitmap(filters), len(self.gifts))
+        gifts = self.gifts
+        return [gifts[position] for position in positions]
+
+    @classmethod
+    def load(cls, db_path: str = None) -> "GiftCatalog":
+        """Читает всю таблицу gifts; веса — из gift_weights, если она есть"""
+        db_path = db_path or DB_PATH
+        version = os.path.getmtime(db_path)
+
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, name, price, description,
+                   budget_tags, gender_tags, age_tags, relationship_tags,
+                   occasion_tags, value_tags, interest_tags
+            FROM gifts
+            ORDER BY id
+        ''')
+        rows = cursor.fetchall()
+        weight_table = load_weight_table(conn) or {}
+        conn.close()
+
+        # Подарок без строк в gift_weights (новый или изменённый после миграции)
+        # разбирается из строки тегов
+        gifts = [gift_from_row(row, weight_table.get(row[0])) for row in rows]
+
+        return cls(gifts, version)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> GiftCatalog:
+    """
+    Возвращает каталог текущего процесса.
+
+    Перечитывает каталог, если у gifts.db изменилось время модификации.
+    """
+    global _catalog
+
+    try:
+        mtime = os.path.getmtime(DB_PATH)
+    except OSError:
+        mtime = None
+
+    catalog = _catalog
+    if catalog is not None and (mtime is None or catalog.version == mtime):
+        return catalog
+
+    with _catalog_lock:
+        if _catalog is None or _catalog.version != mtime:
+            with timed("catalog_load"):
+                _catalog = _load_catalog(mtime)
+        return _catalog
+
+
+def _load_catalog(mtime) -> GiftCatalog:
+    """Колоночный catalog.bin, если он включён и собран из этой версии gifts.db, иначе сама база"""
+    import catalog_mmap
+
+    path = catalog_mmap.CATALOG_MMAP_PATH
+    if path and os.path.exists(path):
+        version = catalog_mmap.read_version(path)
+        if version is not None and (mtime is None or version == mtime):
+            try:
+                return catalog_mmap.MappedCatalog.load(path)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f"⚠️ {path} не читается ({e}) — читаем базу. "
+                      f"Пересоберите: python catalog_mmap.py export", file=sys.stderr)
+        else:
+            print(f"⚠️ {path} собран из другой версии {DB_PATH} — читаем базу. "
+                  f"Пересоберите: python catalog_mmap.py export", file=sys.stderr)
+
+    return GiftCatalog.load(DB_PATH)
+
+
+def reset_catalog():
+    """Сбрасывает каталог — следующий get_catalog() перечитает базу"""
+    global _catalog
+    with _catalog_lock:
+        _catalog = None
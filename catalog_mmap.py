@@ -0,0 +1,358 @@
+"""
+Каталог в колоночном файле, отображённом в память.
+
+Экспорт превращает gifts.db в catalog.bin: id, диапазоны бюджета, битовые
+маски PRIMARY тегов, инвертированные битмапы индекса, матрицы весов VALUE и
+INTERESTS (float64) и строки (название, цена, описание) в отдельном блобе
+со смещениями. Воркеры открывают файл через mmap только на чтение: страницы
+общие для всех процессов, загрузка — это разбор заголовка, а объекты
+подарков создаются по требованию поверх колонок.
+
+MappedCatalog повторяет интерфейс GiftCatalog. get_catalog() берёт его только
+при заданном CATALOG_MMAP_PATH и если файл собран из текущей версии gifts.db.
+По умолчанию выключено: на небольшом каталоге подарки из списка в памяти
+считаются быстрее, чем свойства поверх колонок; mmap окупается, когда каталог
+большой и важна общая между воркерами память.
+
+    python catalog_mmap.py export
+    CATALOG_MMAP_PATH=catalog.bin gunicorn app:app
+    python catalog_mmap.py export --output /srv/gift/catalog.bin
+"""
+import argparse
+import bisect
+import os
+import time
+from array import array
+from collections.abc import Mapping
+
+import mapped_file
+from catalog import DB_PATH, PRIMARY_FIELDS, GiftCatalog
+
+# Пусто — каталог читается из gifts.db
+CATALOG_MMAP_PATH = os.environ.get("CATALOG_MMAP_PATH", "")
+EXPORT_PATH = CATALOG_MMAP_PATH or "catalog.bin"
+
+MAGIC = b"GIFTCAT1"
+FORMAT_VERSION = 1
+
+# Строковые колонки: на подарок по одной строке каждой
+STRING_FIELDS = ("name", "price", "description")
+
+# Секции выровнены под float64 и uint64
+ALIGNMENT = 8
+
+
+# ============== ЭКСПОРТ ==============
+
+def export(db_path: str = None, path: str = None) -> dict:
+    """Собирает catalog.bin из gifts.db и атомарно заменяет старый файл"""
+    db_path = db_path or DB_PATH
+    path = path or EXPORT_PATH
+    source = GiftCatalog.load(db_path)
+    gifts = source.gifts
+    count = len(gifts)
+
+    fields = {field: sorted(source.tag_index[field]) for field in PRIMARY_FIELDS}
+    for field, tags in fields.items():
+        if len(tags) > 64:
+            raise ValueError(f"У поля {field} больше 64 тегов — не помещается в маску")
+    value_tags = sorted({tag for gift in gifts for tag in gift.values})
+    interest_tags = sorted({tag for gift in gifts for tag in gift.interests})
+
+    sections = []  # (имя, байты)
+
+    sections.append(("ids", array('q', (gift.id for gift in gifts)).tobytes()))
+    sections.append(("budget_min", array('b', (gift.budget_min for gift in gifts)).tobytes()))
+    sections.append(("budget_max", array('b', (gift.budget_max for gift in gifts)).tobytes()))
+
+    bitmap_size = (count + 7) // 8
+    for field in PRIMARY_FIELDS:
+        positions = {tag: bit for bit, tag in enumerate(fields[field])}
+        masks = array('Q', (sum(1 << positions[tag] for tag in getattr(gift, field)) for gift in gifts))
+        sections.append((f"mask_{field}", masks.tobytes()))
+        sections.append((f"bitmaps_{field}", b"".join(
+            source.tag_index[field][tag].to_bytes(bitmap_size, "little") for tag in fields[field]
+        )))
+
+    for name, tags, attribute in (("values", value_tags, "values"), ("interests", interest_tags, "interests")):
+        columns = {tag: i for i, tag in enumerate(tags)}
+        matrix = array('d', bytes(8 * count * len(tags)))
+        for row, gift in enumerate(gifts):
+            for tag, weight in getattr(gift, attribute).items():
+                matrix[row * len(tags) + columns[tag]] = weight
+        sections.append((name, matrix.tobytes()))
+
+    blob = bytearray()
+    offsets = array('Q', [0])
+    nulls = bytearray()
+    for gift in gifts:
+        for field in STRING_FIELDS:
+            value = getattr(gift, field)
+            nulls.append(value is None)
+            blob += (value or "").encode("utf-8")
+            offsets.append(len(blob))
+    sections.append(("string_offsets", offsets.tobytes()))
+    sections.append(("string_nulls", bytes(nulls)))
+    sections.append(("strings", bytes(blob)))
+
+    # Смещения секций считаются от начала данных (после заголовка)
+    layout = {}
+    position = 0
+    for name, data in sections:
+        position += mapped_file.pad(position, ALIGNMENT)
+        layout[name] = [position, len(data)]
+        position += len(data)
+
+    header = {
+        'format': FORMAT_VERSION,
+        'version': source.version,
+        'count': count,
+        'fields': fields,
+        'value_tags': value_tags,
+        'interest_tags': interest_tags,
+        'sections': layout,
+    }
+    size = mapped_file.write(path, MAGIC, header, [data for _, data in sections], ALIGNMENT)
+
+    return {'gifts': count, 'bytes': size}
+
+
+# ============== ЧТЕНИЕ ==============
+
+class RowWeights(Mapping):
+    """Веса тегов одного подарка поверх строки матрицы (нулевой вес — тега нет)"""
+
+    __slots__ = ("_columns", "_tags", "_matrix", "_base")
+
+    def __init__(self, columns: dict, tags: list, matrix: memoryview, base: int):
+        self._columns = columns
+        self._tags = tags
+        self._matrix = matrix
+        self._base = base
+
+    def get(self, tag, default=None):
+        column = self._columns.get(tag)
+        if column is None:
+            return default
+        weight = self._matrix[self._base + column]
+        return weight if weight else default
+
+    def __getitem__(self, tag):
+        weight = self.get(tag)
+        if weight is None:
+            raise KeyError(tag)
+        return weight
+
+    def __iter__(self):
+        matrix = self._matrix
+        base = self._base
+        for column, tag in enumerate(self._tags):
+            if matrix[base + column]:
+                yield tag
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class MappedGift:
+    """Подарок — строка колоночного каталога (атрибуты как у CatalogGift)"""
+
+    __slots__ = ("_catalog", "row")
+
+    def __init__(self, catalog: "MappedCatalog", row: int):
+        self._catalog = catalog
+        self.row = row
+
+    def __repr__(self):
+        return f"MappedGift(id={self.id}, name={self.name!r})"
+
+    @property
+    def id(self) -> int:
+        return self._catalog.ids[self.row]
+
+    @property
+    def name(self) -> str:
+        return self._catalog.string(self.row, 0)
+
+    @property
+    def price(self) -> str:
+        return self._catalog.string(self.row, 1)
+
+    @property
+    def description(self) -> str:
+        return self._catalog.string(self.row, 2)
+
+    @property
+    def budget_min(self) -> int:
+        return self._catalog.budget_min[self.row]
+
+    @property
+    def budget_max(self) -> int:
+        return self._catalog.budget_max[self.row]
+
+    @property
+    def values(self) -> RowWeights:
+        catalog = self._catalog
+        return RowWeights(catalog.value_columns, catalog.value_tags, catalog.value_matrix,
+                          self.row * len(catalog.value_tags))
+
+    @property
+    def interests(self) -> RowWeights:
+        catalog = self._catalog
+        return RowWeights(catalog.interest_columns, catalog.interest_tags, catalog.interest_matrix,
+                          self.row * len(catalog.interest_tags))
+
+    def tags(self, field: str) -> frozenset:
+        """PRIMARY теги подарка по битовой маске"""
+        mask = self._catalog.masks[field][self.row]
+        vocabulary = self._catalog.fields[field]
+        return frozenset(tag for bit, tag in enumerate(vocabulary) if mask >> bit & 1)
+
+    budget = property(lambda self: self.tags("budget"))
+    gender = property(lambda self: self.tags("gender"))
+    age = property(lambda self: self.tags("age"))
+    relationship = property(lambda self: self.tags("relationship"))
+    occasion = property(lambda self: self.tags("occasion"))
+
+
+class MappedGifts:
+    """Последовательность подарков без материализации всего списка"""
+
+    __slots__ = ("_catalog",)
+
+    def __init__(self, catalog: "MappedCatalog"):
+        self._catalog = catalog
+
+    def __len__(self):
+        return self._catalog.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [MappedGift(self._catalog, row) for row in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return MappedGift(self._catalog, index)
+
+    def __iter__(self):
+        catalog = self._catalog
+        return (MappedGift(catalog, row) for row in range(catalog.count))
+
+
+class MappedById(Mapping):
+    """Поиск подарка по id: id в файле отсортированы, ищем бинарным поиском"""
+
+    __slots__ = ("_catalog",)
+
+    def __init__(self, catalog: "MappedCatalog"):
+        self._catalog = catalog
+
+    def get(self, gift_id, default=None):
+        ids = self._catalog.ids
+        row = bisect.bisect_left(ids, gift_id)
+        if row < len(ids) and ids[row] == gift_id:
+            return MappedGift(self._catalog, row)
+        return default
+
+    def __getitem__(self, gift_id):
+        gift = self.get(gift_id)
+        if gift is None:
+            raise KeyError(gift_id)
+        return gift
+
+    def __iter__(self):
+        return iter(self._catalog.ids)
+
+    def __len__(self):
+        return self._catalog.count
+
+
+class MappedCatalog(GiftCatalog):
+    """Каталог поверх catalog.bin; методы фильтрации — от GiftCatalog"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mmap, header, base = mapped_file.open_mapped(path, MAGIC, FORMAT_VERSION, ALIGNMENT)
+
+        self.version = header['version']
+        self.count = header['count']
+        self.fields = header['fields']
+        self.value_tags = header['value_tags']
+        self.interest_tags = header['interest_tags']
+        self.value_columns = {tag: i for i, tag in enumerate(self.value_tags)}
+        self.interest_columns = {tag: i for i, tag in enumerate(self.interest_tags)}
+
+        view = memoryview(self._mmap)
+
+        def section(name: str, item_format: str = None) -> memoryview:
+            offset, size = header['sections'][name]
+            part = view[base + offset:base + offset + size]
+            return part.cast(item_format) if item_format else part
+
+        self.ids = section("ids", 'q')
+        self.budget_min = section("budget_min", 'b')
+        self.budget_max = section("budget_max", 'b')
+        self.masks = {field: section(f"mask_{field}", 'Q') for field in PRIMARY_FIELDS}
+        self.value_matrix = section("values", 'd')
+        self.interest_matrix = section("interests", 'd')
+        self.string_offsets = section("string_offsets", 'Q')
+        self.string_nulls = section("string_nulls")
+        self.strings = section("strings")
+
+        # Инвертированный индекс: битмапы переводятся в int (n/8 байт на тег)
+        bitmap_size = (self.count + 7) // 8
+        self.tag_index = {}
+        for field in PRIMARY_FIELDS:
+            bitmaps = section(f"bitmaps_{field}")
+            self.tag_index[field] = {
+                tag: int.from_bytes(bitmaps[i * bitmap_size:(i + 1) * bitmap_size], "little")
+                for i, tag in enumerate(self.fields[field])
+            }
+        self.all_bitmap = (1 << self.count) - 1
+
+        self.gifts = MappedGifts(self)
+        self.by_id = MappedById(self)
+
+    def __len__(self):
+        return self.count
+
+    def string(self, row: int, column: int):
+        index = row * len(STRING_FIELDS) + column
+        if self.string_nulls[index]:
+            return None
+        return str(self.strings[self.string_offsets[index]:self.string_offsets[index + 1]], "utf-8")
+
+    @classmethod
+    def load(cls, path: str = None) -> "MappedCatalog":
+        return cls(path or EXPORT_PATH)
+
+
+def read_version(path: str = None):
+    """Версия gifts.db, из которой собран файл, или None (файла нет или он не наш)"""
+    path = path or EXPORT_PATH
+    try:
+        header = mapped_file.read_header(path, MAGIC)
+    except (OSError, ValueError):
+        return None
+    if header.get('format') != FORMAT_VERSION:
+        return None
+    return header.get('version')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Колоночный каталог для mmap")
+    sub = parser.add_subparsers(dest='command', required=True)
+    export_parser = sub.add_parser('export', help="собрать файл из gifts.db")
+    export_parser.add_argument('--db', default=DB_PATH, help="исходная база")
+    export_parser.add_argument('--output', default=EXPORT_PATH, help="куда записать каталог")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    info = export(args.db, args.output)
+    print(f"✅ {args.output}: {info['gifts']} подарков, {info['bytes'] / 1024:.1f} КБ "
+          f"за {time.perf_counter() - started:.2f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Проверка: Python- и NumPy-бэкенды scoring дают одинаковый рейтинг на gifts.db.
+
+Перебирает все комбинации ответов на вопросы квиза (PRIMARY и VALUE), интересы
+для каждой комбинации берутся по очереди из подмножеств списка, который
+/api/interests отдал бы этому получателю.
+
+    python check_backends.py            # все комбинации
+    python check_backends.py 5000       # случайная выборка из 5000 комбинаций
+"""
+import itertools
+import random
+import sys
+
+from app import QUESTIONS, interests_for, parse_answers
+from catalog import get_catalog
+from scoring import get_top_gifts
+
+
+def interest_subsets(options):
+    """Пустой набор, все одиночные, пары соседей и тройки соседей"""
+    values = [opt['value'] for opt in options]
+    subsets = [[]]
+    subsets += [[v] for v in values]
+    subsets += [values[i:i + 2] for i in range(len(values) - 1)]
+    subsets += [values[i:i + 3] for i in range(len(values) - 2)]
+    return subsets
+
+
+def main():
+    sample = int(sys.argv[1]) if len(sys.argv) > 1 else None
+
+    options = [[{'tag': q['tag'], 'value': opt['value']} for opt in q['options']] for q in QUESTIONS]
+    combinations = itertools.product(*options)
+    if sample:
+        combinations = random.Random(0).sample(list(combinations), sample)
+
+    limit = len(get_catalog())
+    checked = 0
+    mismatches = 0
+
+    for n, answers in enumerate(combinations):
+        filters, value_weights, _ = parse_answers({'answers': list(answers)})
+        subsets = interest_subsets(interests_for(filters.get('gender'), filters.get('age')))
+        interest_weights = {tag: 1.0 for tag in subsets[n % len(subsets)]}
+
+        python_result = get_top_gifts(filters, value_weights, interest_weights, limit, backend="python")
+        numpy_result = get_top_gifts(filters, value_weights, interest_weights, limit, backend="numpy")
+
+        checked += 1
+        if python_result != numpy_result:
+            mismatches += 1
+            if mismatches <= 10:
+                print(f"❌ {filters} {value_weights} {sorted(interest_weights)}")
+
+        if checked % 10000 == 0:
+            print(f"   проверено {checked}...")
+
+    print(f"\nПроверено комбинаций: {checked}")
+    print(f"Расхождений: {mismatches}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
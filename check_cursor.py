@@ -0,0 +1,101 @@
+"""
+Проверка: /api/results/page отклоняет испорченные и устаревшие курсоры.
+
+Через тестовый клиент Flask получает первую страницу и курсор, затем:
+    - тот же курсор отдаёт следующую страницу (200);
+    - испорченный курсор и курсор с чужими типами полей — 400;
+    - если рейтинг в кэше воркера поменялся, курсор к нему не подходит — 409;
+    - повторный запрос с refresh (так клиент отвечает на 409) не пишет ответы
+      в аналитику второй раз.
+Аналитика пишется во временную базу. Любое расхождение — код выхода 1.
+
+    python check_cursor.py
+"""
+import base64
+import json
+import os
+import sys
+import tempfile
+
+import analytics
+import event_store
+import scoring
+from db import close_connection, get_connection
+
+ANSWERS = {
+    'answers': [
+        {'tag': 'gender', 'value': 'gender_male'},
+        {'tag': 'budget', 'value': 'budget_5000'},
+    ],
+    'interests': ['interest_tech'],
+    'page_size': 5,
+    'compact': True,
+}
+
+
+def decode(cursor: str) -> list:
+    return json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+
+
+def encode(payload: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def main():
+    with tempfile.TemporaryDirectory() as workdir:
+        analytics.DB_PATH = os.path.join(workdir, "analytics.db")
+        scoring.ANALYTICS_DB_PATH = analytics.DB_PATH
+        event_store.EVENTS_DIR = os.path.join(workdir, "events")
+        analytics.ASYNC_WRITES = False
+        analytics.init_db()
+
+        import app
+        from results_cache import make_key, results_cache
+
+        client = app.app.test_client()
+        client.get('/quiz')
+        first = client.post('/api/results', json=ANSWERS).get_json()
+        cursor = first['next_cursor']
+        payload = decode(cursor)
+
+        broken = list(payload)
+        broken[0] = dict(payload[0], gender=['gender_male'])
+        checks = [
+            ("курсор следующей страницы", client.get(f'/api/results/page?cursor={cursor}').status_code, 200),
+            ("испорченный курсор", client.get('/api/results/page?cursor=abc').status_code, 400),
+            ("список вместо строки в фильтре", client.get(f'/api/results/page?cursor={encode(broken)}').status_code, 400),
+        ]
+
+        # Другой воркер (или тот же после вытеснения из кэша) считает рейтинг иначе
+        filters, value_weights, interests = payload[0], payload[1], payload[2]
+        key = make_key(filters, value_weights, {interest: 1.0 for interest in interests})
+        version = app.get_catalog().version
+        ranking = results_cache.get(key, version)
+        results_cache.put(key, list(reversed(ranking)), version)
+        stale = client.get(f'/api/results/page?cursor={cursor}')
+        checks.append(("рейтинг в кэше изменился", stale.status_code, 409))
+        checks.append(("ошибка 409 в ответе", stale.get_json(), {'error': 'Stale cursor'}))
+
+        count_answers = "SELECT COUNT(*) FROM answers"
+        before = get_connection(analytics.DB_PATH).execute(count_answers).fetchone()[0]
+        refreshed = client.post('/api/results', json=dict(ANSWERS, refresh=True)).get_json()
+        after = get_connection(analytics.DB_PATH).execute(count_answers).fetchone()[0]
+        checks.append(("новый курсор после refresh",
+                       client.get(f"/api/results/page?cursor={refreshed['next_cursor']}").status_code, 200))
+        checks.append(("refresh не пишет ответы повторно", after - before, 0))
+
+        close_connection(analytics.DB_PATH)
+
+    failures = 0
+    for name, actual, expected in checks:
+        if actual == expected:
+            print(f"✅ {name}")
+        else:
+            failures += 1
+            print(f"❌ {name}: {actual!r}, ожидалось {expected!r}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Проверка: запросы горячего пути аналитики не читают таблицы целиком.
+
+Прогоняет настоящие функции записи (сессия, ответы, оценка, событие,
+завершение) и коллаборативного скоринга на копии базы (события — во временной
+базе месяца), перехватывает каждый выполненный SQL-запрос и смотрит его
+EXPLAIN QUERY PLAN. Любой SCAN таблицы или индекса целиком — ошибка, код выхода 1.
+
+    python check_query_plans.py                     # на пустой базе со свежей схемой
+    python check_query_plans.py --db analytics.db   # на копии рабочей базы
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+
+import analytics
+import collaborative
+import event_store
+import scoring
+from db import close_connection, get_connection
+
+SKIP_PREFIXES = ("BEGIN", "COMMIT", "ROLLBACK", "PRAGMA", "CREATE")
+
+PROFILE = {
+    'gender': 'gender_male',
+    'age': 'age_26_35',
+    'relationship': 'relationship_friend',
+    'occasion': 'occasion_birthday',
+    'budget': ['budget_5000'],
+}
+
+
+def run_hot_path():
+    """Запросы, которые выполняются на каждый /api/results и /api/rate"""
+    session_id = analytics.create_session('check')
+    analytics.save_answers(session_id, PROFILE, {'gift_practical': 1.0}, ['interest_tech'])
+    analytics.save_rating(session_id, 1, 'check', 1)
+    analytics.save_event(session_id, 'results_shown', {'count': 10})
+    analytics.complete_session(session_id)
+    analytics.get_collaborative_score(1, PROFILE)
+    scoring.get_collaborative_scores(PROFILE)
+
+
+def full_scans(conn: sqlite3.Connection, sql: str) -> list:
+    """Строки плана с полным проходом по таблице или индексу"""
+    plan = conn.execute('EXPLAIN QUERY PLAN ' + sql).fetchall()
+    return [row[3] for row in plan if row[3].startswith('SCAN ') and row[3] != 'SCAN CONSTANT ROW']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Планы запросов горячего пути аналитики")
+    parser.add_argument('--db', help="база аналитики, копия которой проверяется")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "analytics.db")
+        if args.db:
+            source = sqlite3.connect(args.db)
+            target = sqlite3.connect(path)
+            source.backup(target)
+            source.close()
+            target.close()
+
+        analytics.DB_PATH = path
+        scoring.ANALYTICS_DB_PATH = path
+        event_store.EVENTS_DIR = os.path.join(workdir, "events")
+        # Запрос, которым scoring читает базу без снимка в памяти
+        collaborative.COLLAB_MAX_STALENESS = 0
+        analytics.init_db()
+
+        # События пишутся в базу текущего месяца — её запросы тоже проверяем
+        events_path = event_store.partition_path(event_store.month_of())
+        os.makedirs(event_store.EVENTS_DIR, exist_ok=True)
+
+        statements = []
+        connections = {path: get_connection(path), events_path: get_connection(events_path)}
+        for db_path, conn in connections.items():
+            conn.set_trace_callback(lambda sql, db_path=db_path: statements.append((db_path, sql)))
+        try:
+            run_hot_path()
+        finally:
+            for conn in connections.values():
+                conn.set_trace_callback(None)
+
+        explain = {db_path: sqlite3.connect(db_path) for db_path in connections}
+        seen = set()
+        failures = 0
+        for db_path, sql in statements:
+            sql = sql.strip()
+            if sql.upper().startswith(SKIP_PREFIXES) or sql in seen:
+                continue
+            seen.add(sql)
+
+            scans = full_scans(explain[db_path], sql)
+            summary = " ".join(sql.split())[:100]
+            if scans:
+                failures += 1
+                print(f"❌ {summary}")
+                for detail in scans:
+                    print(f"      {detail}")
+            else:
+                print(f"✅ {summary}")
+
+        for db_path, conn in explain.items():
+            conn.close()
+            close_connection(db_path)
+
+    print(f"\nПроверено запросов: {len(seen)}")
+    print(f"С полным проходом: {failures}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
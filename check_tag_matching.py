@@ -0,0 +1,84 @@
+"""
+Проверка: теги подарков сравниваются целиком, а не подстрокой.
+
+До каталога scoring проверял теги подстрокой по строке из gifts.db
+('budget_2000' in 'budget_20000, budget_50000'), и короткий тег совпадал
+внутри длинного. Теперь теги разбираются в множества и словари, поэтому:
+    - фильтр budget_2000 / budget_5000 / budget_10000 не пропускает подарки
+      только с budget_20000 / budget_50000 / budget_100000;
+    - диапазон бюджета подарка строится по точным тегам;
+    - gift_practical не берёт вес gift_practical_life.
+Кандидаты каталога для каждого варианта ответа сверяются с точным
+сравнением тегов прямо по строкам gifts.db; сколько подарков отобрало бы
+старое сравнение подстрокой — выводится для сведения.
+
+    python check_tag_matching.py
+"""
+import sqlite3
+import sys
+
+from app import QUESTIONS, parse_answers
+from catalog import DB_PATH, PRIMARY_FIELDS, budget_range, get_catalog, parse_tag_set, parse_tag_weights
+
+# Колонки gifts с PRIMARY тегами, в порядке PRIMARY_FIELDS
+TAG_COLUMNS = ("budget_tags", "gender_tags", "age_tags", "relationship_tags", "occasion_tags")
+
+
+def exact_match(tags_str: str, tag: str) -> bool:
+    return tag in [part.strip() for part in tags_str.split(',')]
+
+
+def reference_ids(rows: list, filters: dict, match) -> list:
+    """id подарков, прошедших фильтры, по сырым строкам тегов"""
+    ids = []
+    for row in rows:
+        tags = dict(zip(PRIMARY_FIELDS, row[1:]))
+        if 'budget' in filters and not any(match(tags['budget'], b) for b in filters['budget']):
+            continue
+        if any(field in filters and not match(tags[field], filters[field]) for field in PRIMARY_FIELDS[1:]):
+            continue
+        ids.append(row[0])
+    return ids
+
+
+def main():
+    checks = [
+        ("budget_2000 не входит в 'budget_20000'", 'budget_2000' in parse_tag_set('budget_20000, budget_50000'), False),
+        ("gender_male не входит в 'gender_female'", 'gender_male' in parse_tag_set('gender_female'), False),
+        ("диапазон бюджета по точным тегам", budget_range(parse_tag_set('budget_20000, budget_50000')), (4, 6)),
+        ("gift_practical без веса gift_practical_life",
+         parse_tag_weights('gift_practical_life:1.0').get('gift_practical'), None),
+    ]
+
+    conn = sqlite3.connect(DB_PATH)
+    rows = conn.execute(f"SELECT id, {', '.join(TAG_COLUMNS)} FROM gifts ORDER BY id").fetchall()
+    conn.close()
+    rows = [(row[0],) + tuple(str(value or '') for value in row[1:]) for row in rows]
+
+    catalog = get_catalog()
+    for question in QUESTIONS:
+        if question['tag'] not in PRIMARY_FIELDS:
+            continue
+        for option in question['options']:
+            filters, _, _ = parse_answers({'answers': [{'tag': question['tag'], 'value': option['value']}]})
+            actual = sorted(gift.id for gift in catalog.candidates(filters))
+            checks.append((f"кандидаты {option['value']}", actual, reference_ids(rows, filters, exact_match)))
+
+            substring = reference_ids(rows, filters, lambda tags_str, tag: tag in tags_str)
+            if len(substring) != len(actual):
+                print(f"⚠️  {option['value']}: подстрокой отобралось бы {len(substring)} подарков, "
+                      f"точно — {len(actual)}")
+
+    failures = 0
+    for name, actual, expected in checks:
+        if actual == expected:
+            print(f"✅ {name}")
+        else:
+            failures += 1
+            print(f"❌ {name}: {actual!r}, ожидалось {expected!r}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Снимок коллаборативных бонусов для чтения в запросах.
+
+Запросы не читают profile_gift_stats из analytics.db: каждый воркер держит
+в памяти готовые бонусы {(пол, возраст, повод): {gift_id: бонус}}, фоновый
+поток перечитывает таблицу раз в COLLAB_MAX_STALENESS / 2 секунд. Запрос
+только берёт словарь из снимка и никогда не ждёт базу и её писателей;
+лайки появляются в рейтинге не позже чем через COLLAB_MAX_STALENESS секунд.
+
+Если с прошлого чтения в базу никто ничего не записал (PRAGMA data_version),
+таблица не перечитывается. Если фоновый поток отстал (завис на блокировке,
+упал), снимок старше COLLAB_MAX_STALENESS перечитывается прямо в запросе.
+
+COLLAB_MAX_STALENESS=0 — читать базу в каждом запросе, как раньше.
+"""
+import os
+import sys
+import threading
+import time
+
+from db import get_connection
+from worker_thread import WorkerThread
+
+COLLAB_MAX_STALENESS = float(os.environ.get("COLLAB_MAX_STALENESS", "10"))
+
+_EMPTY = {}
+
+
+def load_scores(path: str) -> dict:
+    """Все бонусы из profile_gift_stats: {(gender, age, occasion): {gift_id: бонус}}"""
+    from scoring import collaborative_score_from_counts
+
+    conn = get_connection(path)
+    cursor = conn.cursor()
+    cursor.execute('SELECT gender, age, occasion, gift_id, likes, dislikes FROM profile_gift_stats')
+
+    profiles = {}
+    for gender, age, occasion, gift_id, likes, dislikes in cursor.fetchall():
+        score = collaborative_score_from_counts(likes or 0, dislikes or 0)
+        if score:
+            profiles.setdefault((gender, age, occasion), {})[gift_id] = score
+    return profiles
+
+
+def data_version(path: str) -> int:
+    """Меняется, когда в базу коммитит другое соединение (в том числе другой процесс)"""
+    return get_connection(path).execute('PRAGMA data_version').fetchone()[0]
+
+
+class CollaborativeSnapshot:
+    """
+    Бонусы похожих пользователей в памяти процесса.
+
+    Снимок целиком заменяется новым объектом и никогда не меняется на месте,
+    поэтому читается без блокировок. Первая загрузка (и смена пути к базе)
+    происходит в запросе, дальше снимок обновляет фоновый поток; устаревший
+    больше чем на max_staleness снимок запрос перечитывает сам.
+    """
+
+    def __init__(self, max_staleness: float = None):
+        self.max_staleness = max_staleness if max_staleness is not None else COLLAB_MAX_STALENESS
+
+        # (путь к базе, время загрузки по monotonic, бонусы)
+        self._state = None
+        self._load_lock = threading.Lock()
+        self._thread = WorkerThread(self._run, "collaborative-snapshot")
+
+        self.refreshes = 0
+        self.skipped = 0
+        self.failures = 0
+        self.stale_reloads = 0
+
+    def scores(self, path: str, filters: dict) -> dict:
+        """Бонусы профиля {gift_id: бонус}; словарь не изменять"""
+        state = self._state
+        if self._outdated(state, path):
+            state = self._load(path)
+
+        self._thread.ensure_started()
+        return state[2].get((filters.get('gender'), filters.get('age'), filters.get('occasion')), _EMPTY)
+
+    def _outdated(self, state, path: str) -> bool:
+        return state is None or state[0] != path or time.monotonic() - state[1] > self.max_staleness
+
+    def _load(self, path: str):
+        # Перечитывает один запрос, остальные ждут его и берут готовый снимок
+        with self._load_lock:
+            state = self._state
+            if self._outdated(state, path):
+                if state is not None and state[0] == path:
+                    self.stale_reloads += 1
+                state = (path, time.monotonic(), load_scores(path))
+                self._state = state
+                self.refreshes += 1
+            return state
+
+    def _run(self):
+        last_seen = None  # (путь, data_version) последнего чтения
+        while True:
+            time.sleep(self.max_staleness / 2)
+            state = self._state
+            if state is None:
+                continue
+
+            path = state[0]
+            try:
+                seen = (path, data_version(path))
+                if seen == last_seen:
+                    # Никто не писал — текущий снимок актуален
+                    if self._state is state:
+                        self._state = (path, time.monotonic(), state[2])
+                    self.skipped += 1
+                    continue
+                scores = load_scores(path)
+            except Exception as e:
+                self.failures += 1
+                print(f"⚠️ Не удалось обновить снимок коллаборативных оценок: {e}", file=sys.stderr)
+                continue
+
+            # Путь к базе могли сменить, пока мы читали
+            if self._state is not None and self._state[0] == path:
+                self._state = (path, time.monotonic(), scores)
+                self.refreshes += 1
+            last_seen = seen
+
+    def age(self) -> float:
+        """Сколько секунд назад снимок был сверен с базой"""
+        state = self._state
+        return time.monotonic() - state[1] if state is not None else 0.0
+
+    def stats(self) -> dict:
+        state = self._state
+        return {
+            'age_seconds': round(self.age(), 3),
+            'profiles': len(state[2]) if state is not None else 0,
+            'refreshes': self.refreshes,
+            'skipped': self.skipped,
+            'failures': self.failures,
+            'stale_reloads': self.stale_reloads,
+        }
+
+
+snapshot = CollaborativeSnapshot()
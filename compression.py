@@ -0,0 +1,79 @@
+"""
+Сжатие ответов: gzip или br (если установлен пакет brotli) по Accept-Encoding.
+Кодирование выбирается так же, как для статических ответов (payloads.py).
+
+Сжимаются JSON и текст больше COMPRESS_MIN_SIZE байт. Файлы из static/
+сжимаются один раз и берутся из памяти, пока не изменится их ETag.
+"""
+import gzip
+import os
+import threading
+
+from flask import request
+
+from payloads import brotli, choose_encoding
+
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/javascript', 'text/javascript',
+    'text/html', 'text/css', 'text/plain', 'image/svg+xml',
+}
+
+# Сжатые файлы static/: (путь, ETag, кодирование) -> тело
+_static_cache = {}
+_static_lock = threading.Lock()
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def compress_response(response):
+    """after_request: сжимает подходящий ответ"""
+    if (response.status_code != 200 or response.is_streamed and not response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    length = response.content_length
+    if length is not None and length < COMPRESS_MIN_SIZE:
+        return response
+
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None or request.method == 'HEAD':
+        return response
+
+    etag, _ = response.get_etag()
+
+    if response.direct_passthrough:
+        # Файл из static/: сжимаем один раз на версию файла
+        key = (request.path, etag, encoding)
+        body = _static_cache.get(key)
+        if body is None:
+            response.direct_passthrough = False
+            body = compress(response.get_data(), encoding)
+            with _static_lock:
+                _static_cache[key] = body
+        else:
+            response.close()
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        body = compress(data, encoding)
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    response.headers.pop('Accept-Ranges', None)  # диапазоны относятся к несжатому телу
+    if etag:
+        # Слабый ETag: сжатое и исходное тело — одно и то же содержимое,
+        # If-None-Match по-прежнему даёт 304
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,54 @@
+"""
+Долгоживущие соединения SQLite.
+
+Одно соединение на базу в каждом потоке каждого процесса (воркера gunicorn):
+без connect/close на каждый запрос. Базы открываются в режиме WAL с
+synchronous=NORMAL — читатели не блокируют писателей, а коммит не ждёт fsync
+журнала; busy_timeout сглаживает конкуренцию воркеров за блокировку записи.
+"""
+import os
+import sqlite3
+import threading
+
+BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+_local = threading.local()
+
+
+def _thread_connections() -> dict:
+    # После fork соединения родителя использовать нельзя — заводим свои
+    pid = os.getpid()
+    if getattr(_local, "pid", None) != pid:
+        _local.pid = pid
+        _local.connections = {}
+    return _local.connections
+
+
+def get_connection(path: str) -> sqlite3.Connection:
+    """Соединение с базой path для текущего потока"""
+    connections = _thread_connections()
+
+    conn = connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        connections[path] = conn
+
+    return conn
+
+
+def close_connection(path: str):
+    """Закрывает соединение текущего потока с базой path"""
+    conn = _thread_connections().pop(path, None)
+    if conn is not None:
+        conn.close()
+
+
+def close_connections():
+    """Закрывает все соединения текущего потока"""
+    connections = _thread_connections()
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
@@ -0,0 +1,286 @@
+"""
+Помесячное хранилище событий воронки.
+
+События пишутся не в analytics.db, а в отдельный файл на каждый месяц:
+EVENTS_DIR/events-YYYY-MM.db. Запись событий не занимает блокировку базы
+аналитики, где лежат оценки и агрегаты коллаборативного скоринга, а рабочий
+файл остаётся небольшим.
+
+Месяцы старше EVENTS_RETENTION_MONTHS сжимаются в EVENTS_DIR/archive/
+events-YYYY-MM.jsonl.gz (по строке JSON на событие), файл базы удаляется.
+Если в заархивированный месяц позже пришли события, они дописываются в архив
+следующим gzip-фрагментом. Текущий месяц не архивируется никогда.
+
+    python event_store.py list                  # месяцы, события, размеры
+    python event_store.py archive               # сжать месяцы старше срока хранения
+    python event_store.py archive --keep 3
+    python event_store.py migrate               # перенести события из analytics.db
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from db import close_connection, get_connection
+
+EVENTS_DIR = os.environ.get("EVENTS_DIR", "events")
+# Сколько месяцев, включая текущий, события лежат в базах
+EVENTS_RETENTION_MONTHS = int(os.environ.get("EVENTS_RETENTION_MONTHS", "6"))
+
+PARTITION_RE = re.compile(r"^events-(\d{4}-\d{2})\.db$")
+
+# user_version базы месяца, выгруженной в архив: файл вот-вот удалят, писать в него нельзя
+ARCHIVED = 1
+# Сколько раз писатель переоткрывает базу месяца, которую архивируют прямо сейчас
+REOPEN_ATTEMPTS = 20
+
+# Месяц, с базой которого у потока открыто долгоживущее соединение
+_local = threading.local()
+
+
+def month_of(created_at: str = None) -> str:
+    """'2026-10-17 12:00:00' -> '2026-10'; без времени — текущий месяц (UTC)"""
+    if created_at:
+        return created_at[:7]
+    return datetime.now(timezone.utc).strftime('%Y-%m')
+
+
+def partition_path(month: str) -> str:
+    return os.path.join(EVENTS_DIR, f"events-{month}.db")
+
+
+def archive_path(month: str) -> str:
+    return os.path.join(EVENTS_DIR, "archive", f"events-{month}.jsonl.gz")
+
+
+def _create_schema(conn: sqlite3.Connection):
+    # Файл месяца мог только что появиться (или появиться заново после архивации)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY,
+            session_id INTEGER NOT NULL,
+            event_type TEXT NOT NULL,
+            event_data TEXT,
+            created_at TIMESTAMP NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_events_session_type
+        ON events (session_id, event_type)
+    ''')
+
+
+def _write_month(path: str, rows: list) -> bool:
+    """Дописывает события в базу месяца; False — база уже выгружена в архив"""
+    conn = get_connection(path)
+    with conn:
+        # Пометку проверяем под блокировкой записи: архиватор ставит её,
+        # держа ту же блокировку, и после неё только удаляет файл
+        conn.execute('BEGIN IMMEDIATE')
+        if conn.execute('PRAGMA user_version').fetchone()[0] == ARCHIVED:
+            return False
+        _create_schema(conn)
+        conn.executemany(
+            'INSERT INTO events (session_id, event_type, event_data, created_at) VALUES (?, ?, ?, ?)',
+            rows
+        )
+    return True
+
+
+def write_events(rows: list):
+    """
+    Записывает события [(session_id, event_type, event_data_json, created_at), ...].
+
+    Каждый месяц — одной транзакцией в свой файл. Соединения с прошлыми
+    месяцами сразу закрываются: их файлы может заархивировать archive().
+    Если месяц заархивировали, пока запись ждала блокировку, база
+    переоткрывается и события попадают в новый файл месяца.
+    """
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(month_of(row[3]), []).append(row)
+
+    current = month_of()
+    previous = getattr(_local, "month", None)
+    if previous != current:
+        # Наступил новый месяц — прошлый больше не держим открытым
+        if previous is not None:
+            close_connection(partition_path(previous))
+        _local.month = current
+    os.makedirs(EVENTS_DIR, exist_ok=True)
+    for month, month_rows in by_month.items():
+        path = partition_path(month)
+        try:
+            for _ in range(REOPEN_ATTEMPTS):
+                if _write_month(path, month_rows):
+                    break
+                # Архиватор выгрузил базу и сейчас удаляет файл — открываем заново
+                close_connection(path)
+                time.sleep(0.05)
+            else:
+                raise RuntimeError(f"База {path} выгружена в архив, но не удалена")
+        finally:
+            if month != current:
+                close_connection(path)
+
+
+def partitions() -> list:
+    """Месяцы, у которых есть база событий, по возрастанию"""
+    try:
+        names = os.listdir(EVENTS_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(match.group(1) for match in map(PARTITION_RE.match, names) if match)
+
+
+def expired_months(keep: int = None, now: str = None) -> list:
+    """Месяцы с базами старше срока хранения (keep месяцев, включая текущий)"""
+    keep = EVENTS_RETENTION_MONTHS if keep is None else keep
+    if keep < 1:
+        raise ValueError(f"keep={keep}: текущий месяц хранится всегда, нужно keep >= 1")
+    current = month_of(now)
+    year, month = map(int, current.split('-'))
+    index = year * 12 + month - 1 - (keep - 1)
+    cutoff = f"{index // 12:04d}-{index % 12 + 1:02d}"
+    return [month for month in partitions() if month < cutoff and month < current]
+
+
+def archive_month(month: str) -> int:
+    """Сжимает базу месяца в JSONL.gz и удаляет её; возвращает число событий"""
+    if month >= month_of():
+        raise ValueError(f"{month}: текущий месяц не архивируется")
+
+    path = partition_path(month)
+    conn = sqlite3.connect(path, timeout=30)
+    count = 0
+    try:
+        # Блокировка записи на всё время выгрузки. Опоздавшая запись дождётся её,
+        # увидит пометку ARCHIVED и переоткроет базу — уже новый файл месяца
+        conn.execute('BEGIN EXCLUSIVE')
+        if conn.execute('PRAGMA user_version').fetchone()[0] != ARCHIVED:
+            count = _export_month(conn, month)
+            conn.execute(f'PRAGMA user_version = {ARCHIVED}')
+        conn.commit()
+    finally:
+        conn.close()
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    return count
+
+
+def _export_month(conn: sqlite3.Connection, month: str) -> int:
+    """Дописывает события базы месяца в его архив; возвращает число событий"""
+    cursor = conn.execute(
+        'SELECT id, session_id, event_type, event_data, created_at FROM events ORDER BY id'
+    )
+
+    target = archive_path(month)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp = target + ".tmp"
+    count = 0
+    with gzip.open(temp, 'wt', encoding='utf-8') as f:
+        for event_id, session_id, event_type, event_data, created_at in cursor:
+            f.write(json.dumps({
+                'id': event_id,
+                'session_id': session_id,
+                'event_type': event_type,
+                'event_data': json.loads(event_data) if event_data else None,
+                'created_at': created_at,
+            }, ensure_ascii=False) + "\n")
+            count += 1
+
+    if os.path.exists(target):
+        # Месяц уже архивировали — дописываем ещё один gzip-фрагмент
+        with open(target, 'ab') as out, open(temp, 'rb') as chunk:
+            out.write(chunk.read())
+        os.remove(temp)
+    else:
+        os.replace(temp, target)
+    return count
+
+
+def archive(keep: int = None) -> dict:
+    """Архивирует все месяцы старше срока хранения: {месяц: событий}"""
+    return {month: archive_month(month) for month in expired_months(keep)}
+
+
+def iter_archive(month: str):
+    """События заархивированного месяца (словари)"""
+    with gzip.open(archive_path(month), 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def migrate_from(analytics_path: str, batch_size: int = 10000) -> int:
+    """
+    Переносит события из таблицы events базы аналитики по месяцам.
+
+    Перенесённая пачка сразу удаляется из analytics.db, при сбое между
+    записью и удалением задвоится не больше одной пачки. Возвращает число событий.
+    """
+    source = sqlite3.connect(analytics_path)
+    moved = 0
+    try:
+        while True:
+            rows = source.execute('''
+                SELECT id, session_id, event_type, event_data, COALESCE(created_at, CURRENT_TIMESTAMP)
+                FROM events
+                ORDER BY id
+                LIMIT ?
+            ''', (batch_size,)).fetchall()
+            if not rows:
+                break
+            write_events([row[1:] for row in rows])
+            with source:
+                source.execute('DELETE FROM events WHERE id <= ?', (rows[-1][0],))
+            moved += len(rows)
+    finally:
+        source.close()
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Помесячное хранилище событий")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list', help="месяцы в базах и в архиве")
+    archive_parser = sub.add_parser('archive', help="сжать месяцы старше срока хранения")
+    archive_parser.add_argument('--keep', type=int, default=EVENTS_RETENTION_MONTHS,
+                                help="сколько месяцев, включая текущий, оставить в базах")
+    migrate_parser = sub.add_parser('migrate', help="перенести события из analytics.db")
+    migrate_parser.add_argument('--db', default="analytics.db", help="путь к analytics.db")
+    args = parser.parse_args()
+    if args.command == 'archive' and args.keep < 1:
+        parser.error("--keep должен быть не меньше 1: текущий месяц не архивируется")
+
+    if args.command == 'list':
+        for month in partitions():
+            conn = sqlite3.connect(partition_path(month))
+            count = conn.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+            conn.close()
+            size = os.path.getsize(partition_path(month))
+            print(f"   {month}: {count} событий, {size / 1024:.0f} КБ")
+        archive_dir = os.path.join(EVENTS_DIR, "archive")
+        if os.path.isdir(archive_dir):
+            for name in sorted(os.listdir(archive_dir)):
+                size = os.path.getsize(os.path.join(archive_dir, name))
+                print(f"   архив {name}: {size / 1024:.0f} КБ")
+    elif args.command == 'archive':
+        archived = archive(args.keep)
+        for month, count in archived.items():
+            print(f"✅ {month}: {count} событий → {archive_path(month)}")
+        if not archived:
+            print("✅ Архивировать нечего")
+    elif args.command == 'migrate':
+        moved = migrate_from(args.db)
+        print(f"✅ Перенесено событий из {args.db}: {moved}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Нормализованные веса VALUE/INTERESTS: таблица gift_weights в gifts.db.
+
+Строки value_tags / interest_tags ('gift_practical:1.0, ...') раскладываются
+в gift_weights(gift_id, kind, tag, weight), kind — 'value' или 'interest'.
+Каталог (catalog.GiftCatalog.load) читает веса из таблицы готовыми числами
+и разбирает строку только у подарков, для которых строк в таблице нет.
+
+Триггеры удаляют веса подарка при изменении его тегов или удалении — такой
+подарок снова читается из строки, пока миграцию не запустят повторно.
+
+    python gift_weights.py migrate
+    python gift_weights.py migrate --db /srv/gift/gifts.db
+"""
+import argparse
+import sqlite3
+import time
+
+from catalog import DB_PATH, WEIGHT_KINDS, parse_tag_weights
+
+
+def create_schema(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS gift_weights (
+            gift_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            weight REAL NOT NULL,
+            PRIMARY KEY (gift_id, kind, tag)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS gift_weights_on_update
+        AFTER UPDATE OF value_tags, interest_tags ON gifts
+        BEGIN
+            DELETE FROM gift_weights WHERE gift_id = OLD.id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS gift_weights_on_delete
+        AFTER DELETE ON gifts
+        BEGIN
+            DELETE FROM gift_weights WHERE gift_id = OLD.id;
+        END
+    ''')
+
+
+def migrate(db_path: str = None) -> int:
+    """Создаёт gift_weights и заполняет её заново из строк тегов; возвращает число строк"""
+    conn = sqlite3.connect(db_path or DB_PATH)
+    try:
+        with conn:
+            create_schema(conn)
+            conn.execute('DELETE FROM gift_weights')
+            rows = []
+            for gift_id, value_tags, interest_tags in conn.execute(
+                    'SELECT id, value_tags, interest_tags FROM gifts'):
+                for kind, tags_str in zip(WEIGHT_KINDS, (value_tags, interest_tags)):
+                    rows.extend((gift_id, kind, tag, weight)
+                                for tag, weight in parse_tag_weights(tags_str).items())
+            conn.executemany('INSERT INTO gift_weights VALUES (?, ?, ?, ?)', rows)
+        return len(rows)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нормализованные веса подарков")
+    sub = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = sub.add_parser('migrate', help="создать и заполнить gift_weights")
+    migrate_parser.add_argument('--db', default=DB_PATH, help="путь к gifts.db")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    count = migrate(args.db)
+    print(f"✅ {args.db}: {count} весов в gift_weights за {time.perf_counter() - started:.2f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""
+Нагрузочный тест: воспроизводит записанные сессии квиза против приложения.
+
+Каждая сессия проходит настоящие эндпоинты по порядку — /quiz,
+/api/interests, /api/results, /api/rate, /api/complete — со своими cookies.
+Сессии берутся из JSONL-файла или восстанавливаются из analytics.db.
+Запросы идут через Flask test client в этом же процессе или по HTTP на
+запущенный gunicorn. В конце печатается гистограмма задержек по эндпоинтам
+и число ошибок блокировки SQLite («database is locked»).
+
+Формат строки JSONL — либо записанная сессия:
+    {"answers": [{"tag": "budget", "value": "budget_5000"}, ...],
+     "interests": ["interest_tech"], "ratings": [{"gift_id": 12, "rating": 1}],
+     "complete": true}
+либо готовая последовательность запросов:
+    {"requests": [{"method": "GET", "path": "/quiz"},
+                  {"method": "POST", "path": "/api/results", "json": {...}}]}
+
+    python loadtest.py sessions.jsonl --concurrency 8
+    python loadtest.py --from-db analytics.db --sessions 500 --concurrency 16
+    python loadtest.py sessions.jsonl --url http://127.0.0.1:8000 --concurrency 32
+"""
+import argparse
+import http.cookiejar
+import itertools
+import json
+import sqlite3
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import percentile
+
+# Границы корзин гистограммы, мс
+BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+LOCK_MESSAGE = "database is locked"
+
+
+# ============== ЗАГРУЗКА СЕССИЙ ==============
+
+def load_jsonl(path: str) -> list:
+    """Читает сессии из JSONL; строки без answers/requests пропускаются"""
+    sessions = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if 'answers' in record or 'requests' in record:
+                sessions.append(record)
+    return sessions
+
+
+def load_from_db(path: str, limit: int = None) -> list:
+    """Восстанавливает сессии из таблиц answers, ratings и sessions"""
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+
+    query = '''
+        SELECT session_id, gender, age, relationship, occasion, budget,
+               experience, practical_emotional, daily_use, aesthetic, interests
+        FROM answers
+        ORDER BY id
+    '''
+    if limit:
+        query += f' LIMIT {int(limit)}'
+    cursor.execute(query)
+    answer_rows = cursor.fetchall()
+
+    sessions = []
+    for (session_id, gender, age, relationship, occasion, budget,
+         experience, practical_emotional, daily_use, aesthetic, interests) in answer_rows:
+        answers = []
+        budget_tags = json.loads(budget) if budget else []
+        if budget_tags:
+            answers.append({'tag': 'budget', 'value': budget_tags[-1]})
+        for tag, value in (('gender', gender), ('age', age),
+                           ('relationship', relationship), ('occasion', occasion)):
+            if value:
+                answers.append({'tag': tag, 'value': value})
+        if experience is not None:
+            answers.append({'tag': 'gift_experience', 'value': str(experience)})
+        if practical_emotional:
+            answers.append({'tag': 'practical_emotional', 'value': practical_emotional})
+        if daily_use is not None:
+            answers.append({'tag': 'gift_daily_use', 'value': str(daily_use)})
+        if aesthetic is not None:
+            answers.append({'tag': 'gift_aesthetic', 'value': str(aesthetic)})
+
+        cursor.execute(
+            'SELECT gift_id, gift_name, rating FROM ratings WHERE session_id = ? ORDER BY id',
+            (session_id,)
+        )
+        ratings = [{'gift_id': r[0], 'gift_name': r[1], 'rating': r[2]} for r in cursor.fetchall()]
+
+        # События лежат в базах месяцев (event_store.py); завершение есть и в sessions
+        cursor.execute('SELECT completed FROM sessions WHERE id = ?', (session_id,))
+        row = cursor.fetchone()
+        completed = bool(row and row[0])
+
+        sessions.append({
+            'answers': answers,
+            'interests': json.loads(interests) if interests else [],
+            'ratings': ratings,
+            'complete': completed,
+        })
+
+    conn.close()
+    return sessions
+
+
+def session_requests(record: dict) -> list:
+    """Превращает записанную сессию в последовательность запросов"""
+    if 'requests' in record:
+        return record['requests']
+
+    answers = record.get('answers', [])
+    profile = {a.get('tag'): a.get('value') for a in answers}
+    query = urllib.parse.urlencode({
+        'gender': profile.get('gender', 'gender_male'),
+        'age': profile.get('age', 'age_26_35'),
+    })
+
+    requests = [
+        {'method': 'GET', 'path': '/quiz'},
+        {'method': 'GET', 'path': f'/api/interests?{query}'},
+        {'method': 'POST', 'path': '/api/results',
+         'json': {'answers': answers, 'interests': record.get('interests', []),
+                  'page_size': 5, 'compact': True}},
+    ]
+    for rating in record.get('ratings', []):
+        requests.append({'method': 'POST', 'path': '/api/rate', 'json': {
+            'gift_id': rating.get('gift_id'),
+            'gift_name': rating.get('gift_name'),
+            'rating': rating.get('rating'),
+        }})
+    if record.get('complete', True):
+        requests.append({'method': 'POST', 'path': '/api/complete', 'json': {}})
+    return requests
+
+
+# ============== КЛИЕНТЫ ==============
+
+class TestClientSession:
+    """Сессия через Flask test client (cookies хранит сам клиент)"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method: str, path: str, body=None):
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code, response.get_data()
+
+
+class HttpSession:
+    """Сессия по HTTP с собственной cookie jar"""
+
+    def __init__(self, base_url: str, timeout: float):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+
+    def request(self, method: str, path: str, body=None):
+        data = None
+        headers = {}
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+# ============== СТАТИСТИКА ==============
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies = []
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.errors = 0
+        self.lock_errors = 0
+
+    def add(self, seconds: float, status: int, body: bytes):
+        ms = seconds * 1000
+        self.latencies.append(ms)
+        for i, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+        if status >= 400:
+            self.errors += 1
+            if LOCK_MESSAGE.encode() in (body or b''):
+                self.lock_errors += 1
+
+    def percentile(self, p: float) -> float:
+        return percentile(self.latencies, p)
+
+
+class LoadTest:
+    def __init__(self, make_session):
+        self.make_session = make_session
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.lock_exceptions = 0
+        self.sessions_done = 0
+
+    def record(self, endpoint: str, seconds: float, status: int, body: bytes):
+        with self.lock:
+            stats = self.stats.get(endpoint)
+            if stats is None:
+                stats = self.stats[endpoint] = EndpointStats()
+            stats.add(seconds, status, body)
+
+    def run_session(self, record: dict):
+        client = self.make_session()
+        for req in session_requests(record):
+            path = req['path']
+            endpoint = path.split('?', 1)[0]
+            started = time.perf_counter()
+            try:
+                status, body = client.request(req.get('method', 'GET'), path, req.get('json'))
+            except Exception as e:
+                status, body = 599, str(e).encode()
+            self.record(endpoint, time.perf_counter() - started, status, body)
+        with self.lock:
+            self.sessions_done += 1
+
+    def run(self, sessions: list, concurrency: int) -> float:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(self.run_session, sessions))
+        return time.perf_counter() - started
+
+
+def print_report(test: LoadTest, elapsed: float):
+    print(f"\nСессий: {test.sessions_done} за {elapsed:.2f} с "
+          f"({test.sessions_done / elapsed:.1f} сессий/с)\n")
+
+    header = f"{'эндпоинт':<16} {'n':>6} {'ошибки':>7} {'locked':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}"
+    print(header)
+    print("-" * len(header))
+    for endpoint, stats in sorted(test.stats.items()):
+        print(f"{endpoint:<16} {len(stats.latencies):>6} {stats.errors:>7} {stats.lock_errors:>7} "
+              f"{stats.percentile(50):>8.1f} {stats.percentile(95):>8.1f} "
+              f"{stats.percentile(99):>8.1f} {max(stats.latencies):>8.1f}")
+
+    print("\nГистограмма задержек, мс:")
+    labels = [f"≤{b}" for b in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}"]
+    for endpoint, stats in sorted(test.stats.items()):
+        total = len(stats.latencies)
+        print(f"\n   {endpoint}")
+        for label, count in zip(labels, stats.buckets):
+            if count:
+                bar = "█" * max(1, round(count / total * 40))
+                print(f"   {label:>7} {count:>6} {bar}")
+
+    lock_errors = sum(s.lock_errors for s in test.stats.values()) + test.lock_exceptions
+    print(f"\n🔒 Ошибок блокировки SQLite: {lock_errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение сессий квиза под нагрузкой")
+    parser.add_argument('jsonl', nargs='?', help="файл с сессиями в формате JSONL")
+    parser.add_argument('--from-db', help="восстановить сессии из analytics.db")
+    parser.add_argument('--sessions', type=int, help="сколько сессий воспроизвести")
+    parser.add_argument('--concurrency', type=int, default=4, help="одновременных сессий")
+    parser.add_argument('--repeat', type=int, default=1, help="сколько раз прогнать набор")
+    parser.add_argument('--url', help="адрес запущенного приложения (по умолчанию — test client)")
+    parser.add_argument('--timeout', type=float, default=30.0, help="таймаут HTTP-запроса, с")
+    args = parser.parse_args()
+
+    if args.jsonl:
+        sessions = load_jsonl(args.jsonl)
+    elif args.from_db:
+        sessions = load_from_db(args.from_db, args.sessions)
+    else:
+        parser.error("нужен файл JSONL или --from-db")
+
+    if not sessions:
+        print("Нет сессий для воспроизведения")
+        sys.exit(1)
+
+    sessions = list(itertools.chain.from_iterable(itertools.repeat(sessions, args.repeat)))
+    if args.sessions:
+        sessions = list(itertools.islice(itertools.cycle(sessions), args.sessions))
+
+    if args.url:
+        test = LoadTest(lambda: HttpSession(args.url, args.timeout))
+    else:
+        from flask import got_request_exception
+        from app import app
+
+        test = LoadTest(lambda: TestClientSession(app))
+
+        # В test client исключение видно только внутри процесса
+        def on_exception(sender, exception, **extra):
+            if LOCK_MESSAGE in str(exception):
+                with test.lock:
+                    test.lock_exceptions += 1
+
+        got_request_exception.connect(on_exception, app, weak=False)
+
+    print(f"▶️ {len(sessions)} сессий, параллельно {args.concurrency}, "
+          f"{'HTTP ' + args.url if args.url else 'Flask test client'}")
+    elapsed = test.run(sessions, args.concurrency)
+
+    if not args.url:
+        import analytics
+        analytics.writer.flush()
+        writer_stats = analytics.writer.stats()
+        print(f"\n📝 Фоновая запись аналитики: записано {writer_stats['written']}, "
+              f"отброшено {writer_stats['dropped']}, ошибок {writer_stats['failed']}")
+
+    print_report(test, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Бинарные файлы, которые воркеры открывают через mmap (catalog.bin,
+ranking_table.bin): общий формат контейнера и атомарная запись.
+
+    MAGIC (8 байт) | длина заголовка (uint32) | JSON-заголовок | выравнивание
+    секции данных, каждая выровнена от начала данных
+
+Файл собирается во временном файле рядом и подменяет старый через os.replace.
+Воркеры со старым mmap продолжают читать старый файл, пока не откроют новый.
+"""
+import json
+import mmap
+import os
+import struct
+
+
+def pad(size: int, boundary: int) -> int:
+    """Сколько нулевых байт дописать, чтобы size стал кратен boundary"""
+    return (boundary - size % boundary) % boundary
+
+
+def write(path: str, magic: bytes, header: dict, sections: list, alignment: int) -> int:
+    """Атомарно записывает заголовок и секции (bytes или array); возвращает размер файла"""
+    header = json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        prefix = magic + struct.pack("<I", len(header)) + header
+        f.write(prefix + b"\0" * pad(len(prefix), alignment))
+        written = 0
+        for data in sections:
+            f.write(b"\0" * pad(written, alignment))
+            written += pad(written, alignment)
+            f.write(data)
+            written += memoryview(data).nbytes
+    os.replace(tmp_path, path)
+
+    return os.path.getsize(path)
+
+
+def _parse_header(prefix, path: str, magic: bytes, read):
+    if len(prefix) < len(magic) + 4 or prefix[:len(magic)] != magic:
+        raise ValueError(f"{path}: неизвестный формат файла")
+    header_size = struct.unpack_from("<I", prefix, len(magic))[0]
+    raw = read(header_size)
+    if len(raw) != header_size:
+        raise ValueError(f"{path}: файл обрезан")
+    header = json.loads(raw.decode("utf-8"))
+    if not isinstance(header, dict):
+        raise ValueError(f"{path}: испорченный заголовок")
+    return header, header_size
+
+
+def read_header(path: str, magic: bytes) -> dict:
+    """Только заголовок файла, без mmap; ValueError — если файл не этого формата"""
+    with open(path, "rb") as f:
+        header, _ = _parse_header(f.read(len(magic) + 4), path, magic, f.read)
+    return header
+
+
+def open_mapped(path: str, magic: bytes, format_version: int, alignment: int):
+    """
+    Отображает файл в память только на чтение.
+
+    Возвращает (mmap, заголовок, смещение начала данных). ValueError — если
+    файл не этого формата или другой версии.
+    """
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    start = len(magic) + 4
+    header, header_size = _parse_header(
+        data[:start], path, magic, lambda size: bytes(data[start:start + size])
+    )
+    if header.get('format') != format_version:
+        raise ValueError(f"{path}: неподдерживаемая версия формата {header.get('format')}")
+
+    end = start + header_size
+    return data, header, end + pad(end, alignment)
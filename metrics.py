@@ -0,0 +1,181 @@
+"""
+Метрики горячего пути: счётчики и гистограммы в формате Prometheus.
+
+Время этапов (загрузка каталога, фильтрация, скоринг, коллаборативные
+бонусы, сортировка, запись аналитики) пишется в гистограмму
+gift_stage_seconds и копится по текущему запросу — из него собирается
+заголовок Server-Timing. Метрики живут в памяти процесса: каждый воркер
+gunicorn отдаёт на /metrics свои значения.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Границы корзин гистограмм, секунды
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Counter:
+    """Монотонный счётчик с метками"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами и метками"""
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._values = {}  # key -> [counts по корзинам..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry):
+                    cumulative += count
+                    le = _format_labels(key + (("le", repr(bound)),))
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {entry[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {entry[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {entry[-1]}")
+        return lines
+
+
+class Gauge:
+    """Значение, которое считывается в момент выдачи метрик"""
+
+    def __init__(self, name: str, help_text: str, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        for key, value in self.read():
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+_registry = []
+
+
+def counter(name: str, help_text: str) -> Counter:
+    metric = Counter(name, help_text)
+    _registry.append(metric)
+    return metric
+
+
+def histogram(name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    metric = Histogram(name, help_text, buckets)
+    _registry.append(metric)
+    return metric
+
+
+def gauge(name: str, help_text: str, read) -> Gauge:
+    """read() возвращает [(метки, значение), ...], метки — кортеж пар"""
+    metric = Gauge(name, help_text, read)
+    _registry.append(metric)
+    return metric
+
+
+def render_prometheus() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ============== ЭТАПЫ ЗАПРОСА ==============
+
+stage_seconds = histogram("gift_stage_seconds", "Время этапов обработки запроса")
+
+# Тайминги текущего запроса: {этап: секунды}; None — вне запроса
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def start_request():
+    """Начинает сбор таймингов текущего запроса"""
+    _request_timings.set({})
+
+
+def request_timings() -> dict:
+    """Тайминги этапов текущего запроса"""
+    return _request_timings.get() or {}
+
+
+def observe_stage(stage: str, seconds: float):
+    """Записывает длительность этапа в гистограмму и в тайминги запроса"""
+    stage_seconds.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage: str):
+    """with timed("filter"): ... — замер этапа"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def server_timing_header(timings: dict) -> str:
+    """Значение заголовка Server-Timing (миллисекунды)"""
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items())
+
+
+def percentile(values: list, p: float) -> float:
+    """p-й перцентиль по ближайшему рангу (для бенчмарков и нагрузочных тестов)"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(int(round(p / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
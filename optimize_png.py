@@ -0,0 +1,164 @@
+"""
+Оптимизация PNG для static/ (нужен numpy).
+
+Уменьшает картинку до --max-size пикселей по большей стороне (усреднение по
+площади в премультиплицированной альфе — без тёмных ореолов по краям),
+обнуляет цвет полностью прозрачных пикселей, подбирает фильтр для каждой
+строки и сжимает zlib на максимальном уровне. Из служебных чанков остаются
+только sRGB и gAMA.
+
+    python optimize_png.py static/gift.png static/gift.png --max-size 560
+"""
+import argparse
+import os
+import struct
+import zlib
+
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+KEEP_CHUNKS = (b"sRGB", b"gAMA")
+CHANNELS = {0: 1, 2: 3, 4: 2, 6: 4}  # тип цвета -> число каналов
+
+
+def read_chunks(data: bytes) -> list:
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("не PNG")
+    chunks = []
+    pos = len(PNG_SIGNATURE)
+    while pos < len(data):
+        length, = struct.unpack(">I", data[pos:pos + 4])
+        chunks.append((data[pos + 4:pos + 8], data[pos + 8:pos + 8 + length]))
+        pos += 12 + length
+    return chunks
+
+
+def paeth(a, b, c):
+    pa = np.abs(b - c)
+    pb = np.abs(a - c)
+    pc = np.abs(a + b - 2 * c)
+    return np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+
+
+def unfilter(raw: bytes, height: int, stride: int, bpp: int) -> np.ndarray:
+    rows = np.zeros((height, stride), dtype=np.int32)
+    prev = np.zeros(stride, dtype=np.int32)
+    for y in range(height):
+        start = y * (stride + 1)
+        kind = raw[start]
+        line = np.frombuffer(raw, dtype=np.uint8, count=stride, offset=start + 1).astype(np.int32)
+        if kind == 0:
+            cur = line
+        elif kind == 2:
+            cur = (line + prev) & 255
+        else:
+            # Sub, Average и Paeth зависят от уже восстановленных байтов слева
+            cur = np.zeros(stride, dtype=np.int32)
+            for x in range(stride):
+                a = cur[x - bpp] if x >= bpp else 0
+                b = prev[x]
+                if kind == 1:
+                    predictor = a
+                elif kind == 3:
+                    predictor = (a + b) // 2
+                else:
+                    c = prev[x - bpp] if x >= bpp else 0
+                    pa, pb, pc = abs(b - c), abs(a - c), abs(a + b - 2 * c)
+                    predictor = a if pa <= pb and pa <= pc else (b if pb <= pc else c)
+                cur[x] = (line[x] + predictor) & 255
+        rows[y] = cur
+        prev = cur
+    return rows
+
+
+def filter_rows(rows: np.ndarray, bpp: int) -> bytes:
+    """Для каждой строки берём фильтр с минимальной суммой модулей (эвристика libpng)"""
+    out = []
+    prev = np.zeros(rows.shape[1], dtype=np.int32)
+    pad = np.zeros(bpp, dtype=np.int32)
+    for cur in rows:
+        a = np.concatenate([pad, cur[:-bpp]])
+        c = np.concatenate([pad, prev[:-bpp]])
+        candidates = [cur, cur - a, cur - prev, cur - (a + prev) // 2, cur - paeth(a, prev, c)]
+        candidates = [(candidate & 255).astype(np.uint8) for candidate in candidates]
+        kind = min(range(5), key=lambda i: int(np.abs(candidates[i].view(np.int8).astype(np.int32)).sum()))
+        out.append(bytes([kind]) + candidates[kind].tobytes())
+        prev = cur
+    return b"".join(out)
+
+
+def area_weights(size_in: int, size_out: int) -> np.ndarray:
+    scale = size_in / size_out
+    weights = np.zeros((size_out, size_in))
+    for i in range(size_out):
+        start, end = i * scale, (i + 1) * scale
+        for j in range(int(start), min(int(np.ceil(end)), size_in)):
+            weights[i, j] = min(end, j + 1) - max(start, j)
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+def resize(pixels: np.ndarray, width: int, height: int) -> np.ndarray:
+    """Уменьшение усреднением по площади; альфа — премультиплицированная"""
+    image = pixels.astype(np.float64)
+    has_alpha = image.shape[2] in (2, 4)
+    if has_alpha:
+        image[..., :-1] *= image[..., -1:] / 255
+
+    image = np.tensordot(area_weights(image.shape[0], height), image, axes=1)
+    image = np.tensordot(area_weights(image.shape[1], width), image, axes=([1], [1])).transpose(1, 0, 2)
+
+    if has_alpha:
+        alpha = image[..., -1:]
+        image[..., :-1] = np.where(alpha > 0, image[..., :-1] / np.maximum(alpha / 255, 1e-9), 0)
+    return np.clip(np.round(image), 0, 255).astype(np.int32)
+
+
+def optimize(data: bytes, max_size: int = None) -> bytes:
+    chunks = read_chunks(data)
+    header = next(body for kind, body in chunks if kind == b"IHDR")
+    width, height, depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", header)
+    if depth != 8 or interlace or color_type not in CHANNELS:
+        raise ValueError("поддерживаются только 8-битные PNG без чересстрочности и палитры")
+
+    channels = CHANNELS[color_type]
+    raw = zlib.decompress(b"".join(body for kind, body in chunks if kind == b"IDAT"))
+    pixels = unfilter(raw, height, width * channels, channels).reshape(height, width, channels)
+
+    if max_size and max(width, height) > max_size:
+        scale = max_size / max(width, height)
+        width, height = max(1, round(width * scale)), max(1, round(height * scale))
+        pixels = resize(pixels, width, height)
+
+    if channels in (2, 4):
+        pixels[pixels[..., -1] == 0] = 0  # невидимый цвет только мешает сжатию
+
+    idat = zlib.compress(filter_rows(pixels.reshape(height, width * channels), channels), 9)
+
+    def chunk(kind: bytes, body: bytes) -> bytes:
+        return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body))
+
+    out = [PNG_SIGNATURE, chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))]
+    out += [chunk(kind, body) for kind, body in chunks if kind in KEEP_CHUNKS]
+    out += [chunk(b"IDAT", idat), chunk(b"IEND", b"")]
+    return b"".join(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Оптимизация PNG")
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--max-size', type=int, help="максимальный размер стороны, px")
+    args = parser.parse_args()
+
+    with open(args.input, 'rb') as f:
+        data = f.read()
+    optimized = optimize(data, args.max_size)
+    with open(args.output + '.tmp', 'wb') as f:
+        f.write(optimized)
+    os.replace(args.output + '.tmp', args.output)
+
+    print(f"✅ {args.output}: {len(data) / 1024:.0f} КБ → {len(optimized) / 1024:.0f} КБ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Статические JSON-ответы (вопросы квиза, списки интересов).
+
+Сериализуются один раз при старте вместе со сжатыми версиями (gzip и,
+если установлен пакет brotli, br). Отдаются со строгим ETag и долгим
+Cache-Control, на If-None-Match с тем же ETag отвечаем 304 без тела.
+"""
+import gzip
+import hashlib
+import json
+import os
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Сколько браузер может не перепроверять ответ, секунды
+STATIC_MAX_AGE = int(os.environ.get("STATIC_PAYLOAD_MAX_AGE", "86400"))
+
+# Поддерживаемые сжатия в порядке предпочтения (при равном q у клиента)
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encodings):
+    """Сжатие с наибольшим q в Accept-Encoding (при равенстве — br), None — без сжатия"""
+    best, best_quality = None, 0
+    for encoding in ENCODINGS:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def dump_json(data) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class StaticPayload:
+    """Готовый JSON-ответ: тело, сжатые варианты и ETag для каждого"""
+
+    def __init__(self, data, max_age: int = None):
+        self.data = data
+        self.max_age = STATIC_MAX_AGE if max_age is None else max_age
+
+        body = dump_json(data)
+        digest = hashlib.sha256(body).hexdigest()[:32]
+
+        # У каждого кодирования свой строгий ETag — это разные представления
+        self.bodies = {None: (body, f'"{digest}"')}
+        self.bodies['gzip'] = (gzip.compress(body, compresslevel=9, mtime=0), f'"{digest}-gz"')
+        if brotli is not None:
+            self.bodies['br'] = (brotli.compress(body, quality=11), f'"{digest}-br"')
+        self.etags = [etag for _, etag in self.bodies.values()]
+
+    def response(self, request) -> Response:
+        encoding = choose_encoding(request.accept_encodings)
+        body, etag = self.bodies[encoding]
+
+        headers = {
+            'ETag': etag,
+            'Cache-Control': f'public, max-age={self.max_age}',
+            'Vary': 'Accept-Encoding',
+        }
+
+        # Любой из наших ETag означает, что у клиента актуальные данные
+        if_none_match = request.if_none_match
+        if if_none_match and any(if_none_match.contains_weak(tag.strip('"')) for tag in self.etags):
+            return Response(status=304, headers=headers)
+
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+        return Response(body, mimetype='application/json', headers=headers)
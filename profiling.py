@@ -0,0 +1,173 @@
+"""
+Профилирование медленных запросов /api/results.
+
+Включается PROFILE_SLOW_REQUESTS=1. Доля запросов PROFILE_SAMPLE_RATE
+выполняется под cProfile; профиль сохраняется, только если запрос занял
+больше PROFILE_THRESHOLD_MS. Профили пишутся в PROFILE_DIR (хранятся
+последние PROFILE_KEEP) вместе с JSON-файлом, где лежат нормализованные
+ответы квиза — так видно, на каких комбинациях запрос тормозит.
+
+Отчёт по накопленным профилям:
+    python profiling.py report
+    python profiling.py report --top 40 --sort tottime --where gender=gender_female
+"""
+import argparse
+import contextvars
+import cProfile
+import functools
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import time
+
+PROFILE_ENABLED = os.environ.get("PROFILE_SLOW_REQUESTS", "0") == "1"
+PROFILE_THRESHOLD_MS = float(os.environ.get("PROFILE_THRESHOLD_MS", "200"))
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0.05"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "200"))
+
+# Описание текущего запроса для имени и метаданных профиля
+_request_tags = contextvars.ContextVar("profile_tags", default=None)
+
+
+def set_profile_tags(**tags):
+    """Запоминает ответы квиза текущего запроса (попадут в метаданные профиля)"""
+    _request_tags.set(tags)
+
+
+def _slug(tags: dict) -> str:
+    filters = tags.get('filters') or {}
+    parts = [filters.get(field) for field in ('gender', 'age', 'relationship', 'occasion')]
+    budget = filters.get('budget')
+    if budget:
+        parts.insert(0, budget[-1])
+    slug = "-".join(part for part in parts if part) or "nofilters"
+    return re.sub(r'[^A-Za-z0-9_-]', '', slug)[:120]
+
+
+def _rotate(directory: str, keep: int):
+    # Удаляем самые старые профили (с их метаданными)
+    profiles = sorted(
+        (name for name in os.listdir(directory) if name.endswith('.prof')),
+        reverse=True
+    )
+    for name in profiles[keep:]:
+        for path in (name, name[:-len('.prof')] + '.json'):
+            try:
+                os.remove(os.path.join(directory, path))
+            except FileNotFoundError:
+                pass  # уже удалил соседний воркер
+
+
+def save_profile(profiler: cProfile.Profile, elapsed_ms: float, tags: dict,
+                 directory: str = None, keep: int = None) -> str:
+    """Сохраняет профиль и метаданные, возвращает путь к .prof"""
+    directory = directory or PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+
+    # Имя сортируется по времени: самые старые удаляются первыми
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**9:09d}-{os.getpid()}-{_slug(tags)}"
+    path = os.path.join(directory, name + '.prof')
+    profiler.dump_stats(path)
+
+    with open(os.path.join(directory, name + '.json'), 'w', encoding='utf-8') as f:
+        json.dump({'elapsed_ms': round(elapsed_ms, 2), **tags}, f, ensure_ascii=False)
+
+    _rotate(directory, keep if keep is not None else PROFILE_KEEP)
+    return path
+
+
+def profile_slow_requests(view):
+    """Декоратор view: выборочно профилирует и сохраняет медленные запросы"""
+    if not PROFILE_ENABLED:
+        return view
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if random.random() >= PROFILE_SAMPLE_RATE:
+            return view(*args, **kwargs)
+
+        _request_tags.set(None)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            profiler.disable()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if elapsed_ms >= PROFILE_THRESHOLD_MS:
+                try:
+                    save_profile(profiler, elapsed_ms, _request_tags.get() or {})
+                except OSError as e:
+                    print(f"⚠️ Не удалось сохранить профиль: {e}", file=sys.stderr)
+
+    return wrapper
+
+
+# ============== ОТЧЁТ ==============
+
+def load_profiles(directory: str, where: dict = None) -> list:
+    """[(путь к .prof, метаданные), ...] с отбором по значениям filters"""
+    profiles = []
+    if not os.path.isdir(directory):
+        return profiles
+
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.prof'):
+            continue
+        try:
+            with open(os.path.join(directory, name[:-len('.prof')] + '.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        filters = meta.get('filters') or {}
+        if where and any(str(filters.get(key)) != value for key, value in where.items()):
+            continue
+        profiles.append((os.path.join(directory, name), meta))
+    return profiles
+
+
+def print_report(directory: str, top: int, sort: str, where: dict):
+    profiles = load_profiles(directory, where)
+    if not profiles:
+        print(f"Профилей в {directory} нет")
+        return
+
+    print(f"\n🐢 Профилей: {len(profiles)}\n")
+    print("Самые медленные запросы:")
+    slowest = sorted(profiles, key=lambda p: p[1].get('elapsed_ms', 0), reverse=True)
+    for path, meta in slowest[:10]:
+        filters = meta.get('filters') or {}
+        profile = ", ".join(
+            filters.get(field) or '—' for field in ('gender', 'age', 'relationship', 'occasion')
+        )
+        budget = (filters.get('budget') or ['—'])[-1]
+        print(f"   {meta.get('elapsed_ms', 0):>8.1f} мс  {budget}, {profile}  "
+              f"интересы: {', '.join(meta.get('interests') or []) or '—'}")
+
+    print(f"\nТоп-{top} функций ({sort}):")
+    stats = pstats.Stats(*(path for path, _ in profiles))
+    stats.strip_dirs().sort_stats(sort).print_stats(top)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отчёт по профилям медленных запросов")
+    sub = parser.add_subparsers(dest='command', required=True)
+    report = sub.add_parser('report', help="сводка по функциям из всех профилей")
+    report.add_argument('--dir', default=PROFILE_DIR, help="каталог с профилями")
+    report.add_argument('--top', type=int, default=25, help="сколько функций показать")
+    report.add_argument('--sort', default='cumulative', help="ключ сортировки pstats")
+    report.add_argument('--where', action='append', default=[], metavar='ПОЛЕ=ЗНАЧЕНИЕ',
+                        help="только профили с таким значением в filters")
+    args = parser.parse_args()
+
+    where = dict(item.split('=', 1) for item in args.where)
+    print_report(args.dir, args.top, args.sort, where)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Таблица ранжирования: заранее посчитанные кандидаты для всех комбинаций
+PRIMARY ответов (бюджет × пол × возраст × кем приходится × повод).
+
+Для каждой комбинации хранится список строк каталога, прошедших PRIMARY
+фильтрацию, и баллы за бюджет (в половинках балла, int8). В запросе
+остаётся досчитать VALUE/INTERESTS и лайки похожих пользователей.
+
+Файл открывается через mmap только на чтение — страницы общие для всех
+воркеров gunicorn. Контейнер — mapped_file (выравнивание до 4), секции:
+    offsets: uint32[комбинаций + 1] | rows: uint32[N] | budget: int8[N]
+В заголовке — отпечаток каталога: если gifts.db поменялся, а таблицу не
+пересобрали, она не используется и scoring считает кандидатов по индексу.
+
+    python ranking_table.py build
+    python ranking_table.py build --output /srv/gift/ranking_table.bin
+"""
+import argparse
+import hashlib
+import itertools
+import os
+import sys
+import threading
+import time
+from array import array
+
+import mapped_file
+from catalog import BUDGET_ORDER, PRIMARY_FIELDS, bitmap_positions, get_catalog
+
+RANKING_TABLE_PATH = os.environ.get("RANKING_TABLE_PATH", "ranking_table.bin")
+
+MAGIC = b"GIFTRNK1"
+FORMAT_VERSION = 1
+ALIGNMENT = 4
+
+
+def catalog_fingerprint(catalog) -> str:
+    """Отпечаток всего, от чего зависит таблица: порядок подарков и их PRIMARY теги"""
+    digest = hashlib.sha1()
+    for gift in catalog.gifts:
+        parts = [str(gift.id), str(gift.budget_min), str(gift.budget_max)]
+        for field in PRIMARY_FIELDS:
+            parts.append(",".join(sorted(getattr(gift, field))))
+        digest.update("|".join(parts).encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def field_values(catalog) -> dict:
+    """Варианты ответа по каждому PRIMARY полю (то, что встречается в каталоге)"""
+    values = {'budget': list(BUDGET_ORDER)}
+    for field in PRIMARY_FIELDS[1:]:
+        values[field] = sorted(catalog.tag_index[field])
+    return values
+
+
+# ============== СБОРКА ==============
+
+def build(catalog=None, path: str = None) -> dict:
+    """Считает таблицу для каталога и атомарно записывает её в path"""
+    from scoring import budget_score_for_range
+
+    catalog = catalog or get_catalog()
+    path = path or RANKING_TABLE_PATH
+    values = field_values(catalog)
+
+    offsets = array('I', [0])
+    rows = array('I')
+    budget = array('b')
+
+    gifts = catalog.gifts
+    for combination in itertools.product(*(range(len(values[field])) for field in PRIMARY_FIELDS)):
+        budget_index = combination[0]
+        filters = {'budget': BUDGET_ORDER[:budget_index + 1]}
+        for field, value_index in zip(PRIMARY_FIELDS[1:], combination[1:]):
+            filters[field] = values[field][value_index]
+
+        for row in bitmap_positions(catalog.candidate_bitmap(filters), len(gifts)):
+            gift = gifts[row]
+            rows.append(row)
+            budget.append(int(budget_score_for_range(budget_index, gift.budget_min, gift.budget_max) * 2))
+        offsets.append(len(rows))
+
+    header = {
+        'format': FORMAT_VERSION,
+        'fingerprint': catalog_fingerprint(catalog),
+        'gifts': len(gifts),
+        'fields': [field for field in PRIMARY_FIELDS],
+        'values': values,
+        'combinations': len(offsets) - 1,
+        'rows': len(rows),
+    }
+    size = mapped_file.write(path, MAGIC, header, [offsets, rows, budget], ALIGNMENT)
+
+    return {'combinations': len(offsets) - 1, 'rows': len(rows), 'bytes': size}
+
+
+# ============== ЧТЕНИЕ ==============
+
+class RankingTable:
+    """Таблица ранжирования, отображённая в память"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+
+        self._mmap, header, offset = mapped_file.open_mapped(path, MAGIC, FORMAT_VERSION, ALIGNMENT)
+
+        self.fingerprint = header['fingerprint']
+        self.gift_count = header['gifts']
+        self.fields = header['fields']
+        self.positions = {
+            field: {value: i for i, value in enumerate(header['values'][field])}
+            for field in self.fields
+        }
+        self.radix = [len(header['values'][field]) for field in self.fields]
+
+        count = header['combinations']
+        total = header['rows']
+        view = memoryview(self._mmap)
+        self.offsets = view[offset:offset + (count + 1) * 4].cast('I')
+        offset += (count + 1) * 4
+        self.rows = view[offset:offset + total * 4].cast('I')
+        offset += total * 4
+        self.budget = view[offset:offset + total].cast('b')
+
+    def combination(self, filters: dict):
+        """Номер комбинации или None, если ответы не из таблицы"""
+        budget = filters.get('budget')
+        if not budget or budget[-1] not in BUDGET_ORDER:
+            return None
+        budget_index = BUDGET_ORDER.index(budget[-1])
+        # В таблице только «до X₽» — все бюджеты не дороже выбранного
+        if list(budget) != BUDGET_ORDER[:budget_index + 1]:
+            return None
+
+        number = self.positions['budget'].get(budget[-1])
+        if number is None:
+            return None
+        for field, radix in zip(self.fields[1:], self.radix[1:]):
+            position = self.positions[field].get(filters.get(field))
+            if position is None:
+                return None
+            number = number * radix + position
+        return number
+
+    def lookup(self, filters: dict):
+        """
+        (rows, budget_halves) для ответов пользователя или None.
+
+        rows — номера строк каталога по возрастанию, budget_halves — баллы за
+        бюджет, умноженные на 2.
+        """
+        number = self.combination(filters)
+        if number is None:
+            return None
+        start, end = self.offsets[number], self.offsets[number + 1]
+        return self.rows[start:end], self.budget[start:end]
+
+
+_table = None
+_table_catalog = None
+_table_lock = threading.Lock()
+_warned = set()
+
+
+def get_ranking_table(catalog):
+    """
+    Таблица для каталога catalog или None (файла нет, он устарел или повреждён).
+
+    Перечитывает файл, если у него изменилось время модификации.
+    """
+    global _table, _table_catalog
+
+    path = RANKING_TABLE_PATH
+    if not path:
+        return None
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    table = _table
+    if table is not None and table.path == path and table.mtime == mtime and _table_catalog is catalog:
+        return table if table.fingerprint is not None else None
+
+    with _table_lock:
+        if (_table is None or _table.path != path or _table.mtime != mtime
+                or _table_catalog is not catalog):
+            try:
+                table = RankingTable(path)
+            except (OSError, ValueError, KeyError) as e:
+                _warn(path, f"⚠️ Таблица ранжирования {path} не читается: {e}")
+                return None
+            if table.gift_count != len(catalog) or table.fingerprint != catalog_fingerprint(catalog):
+                _warn(path, f"⚠️ Таблица ранжирования {path} устарела — пересоберите: "
+                            f"python ranking_table.py build")
+                table.fingerprint = None
+            _table = table
+            _table_catalog = catalog
+        table = _table
+
+    return table if table.fingerprint is not None else None
+
+
+def _warn(path: str, message: str):
+    # Одно предупреждение на файл, а не на каждый запрос
+    if path not in _warned:
+        _warned.add(path)
+        print(message, file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Таблица ранжирования PRIMARY комбинаций")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build_parser = sub.add_parser('build', help="собрать таблицу по gifts.db")
+    build_parser.add_argument('--output', default=RANKING_TABLE_PATH, help="куда записать таблицу")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    info = build(get_catalog(), args.output)
+    print(f"✅ {args.output}: {info['combinations']} комбинаций, {info['rows']} строк, "
+          f"{info['bytes'] / 1024:.1f} КБ за {time.perf_counter() - started:.2f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Кэш результатов подбора по нормализованным ответам квиза.
+
+Ответов у квиза конечное число, а трафик сосредоточен на нескольких сотнях
+популярных комбинаций, поэтому готовый рейтинг переиспользуется между
+запросами. Память ограничена LRU, TTL нужен, чтобы подтягивались свежие
+лайки (коллаборативный бонус), а при изменении gifts.db кэш сбрасывается.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Настройки через переменные окружения
+RESULTS_CACHE_SIZE = int(os.environ.get("RESULTS_CACHE_SIZE", "1024"))
+RESULTS_CACHE_TTL = float(os.environ.get("RESULTS_CACHE_TTL", "300"))
+
+
+def make_key(filters: dict, value_weights: dict, interests) -> tuple:
+    """Каноническая форма ответов: не зависит от порядка ключей и интересов"""
+    normalized_filters = []
+    for tag, value in sorted(filters.items()):
+        if isinstance(value, (list, tuple)):
+            value = tuple(value)
+        normalized_filters.append((tag, value))
+
+    return (
+        tuple(normalized_filters),
+        tuple(sorted((tag, float(weight)) for tag, weight in value_weights.items())),
+        tuple(sorted(set(interests))),
+    )
+
+
+class ResultsCache:
+    """LRU-кэш с TTL и счётчиками попаданий"""
+
+    def __init__(self, maxsize: int = RESULTS_CACHE_SIZE, ttl: float = RESULTS_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        # Каталог перечитан — все сохранённые рейтинги устарели
+        if version != self.version:
+            if self._items:
+                self.invalidations += 1
+            self._items.clear()
+            self.version = version
+
+    def get(self, key, version=None):
+        """Возвращает сохранённое значение или None"""
+        with self._lock:
+            self._check_version(version)
+
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, version=None):
+        """Сохраняет значение, вытесняя самые старые записи"""
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._check_version(version)
+
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Явная инвалидация"""
+        with self._lock:
+            if self._items:
+                self.invalidations += 1
+            self._items.clear()
+
+    def stats(self) -> dict:
+        """Счётчики для подбора размера кэша"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._items),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups * 100, 1) if lookups > 0 else 0,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+results_cache = ResultsCache()
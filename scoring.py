@@ -1,73 +1,90 @@
-import sqlite3
+import heapq
+import os
+import time
+
+import collaborative
+from catalog import BUDGET_ORDER, budget_range, get_catalog, parse_tag_set
+from db import get_connection
+from metrics import observe_stage, timed
+from ranking_table import get_ranking_table
 
-DB_PATH = "gifts.db"
 ANALYTICS_DB_PATH = "analytics.db"
 
-# Порядок бюджетов
-BUDGET_ORDER = ["budget_2000", "budget_5000", "budget_10000", "budget_15000",
-                "budget_20000", "budget_30000", "budget_50000", "budget_100000"]
+# Бэкенд расчёта: "python" (по умолчанию) или "numpy" (см. scoring_numpy.py)
+SCORING_BACKEND = os.environ.get("SCORING_BACKEND", "python")
 
 
-def get_collaborative_score(gift_id: int, filters: dict) -> float:
+def collaborative_score_from_counts(likes: int, dislikes: int) -> float:
+    """Переводит лайки/дизлайки похожих пользователей в бонус от -3 до +3"""
+    total = likes + dislikes
+    if total == 0:
+        return 0.0
+    
+    # Рассчитываем скор от -1 до +1
+    score = (likes - dislikes) / total
+    
+    # Учитываем количество оценок (больше оценок = больше доверия)
+    confidence = min(total / 10, 1.0)  # Максимум при 10+ оценках
+    
+    return score * confidence * 3.0  # До ±3 баллов
+
+
+def get_collaborative_scores(filters: dict, gift_ids=None) -> dict:
     """
-    Рассчитывает бонус на основе лайков похожих пользователей.
+    Рассчитывает бонусы на основе лайков похожих пользователей сразу для всех подарков.
     
-    Ищет сессии с похожим профилем (пол, возраст, повод) и смотрит их оценки.
+    Похожие сессии — совпадение профиля (пол, возраст, повод). Лайки и дизлайки
+    берутся из таблицы profile_gift_stats, которую analytics.py обновляет при
+    каждой оценке: из снимка в памяти (collaborative.py) или, если он выключен,
+    прямо из базы. Возвращает {gift_id: score}, подарков без оценок в словаре нет;
+    словарь не изменять. Если передан gift_ids — только для этих подарков.
     """
     try:
-        conn = sqlite3.connect(ANALYTICS_DB_PATH)
-        cursor = conn.cursor()
-        
-        # Находим похожие сессии (совпадение по gender, age, occasion)
-        cursor.execute('''
-            SELECT a.session_id 
-            FROM answers a
-            WHERE a.gender = ? 
-              AND a.age = ?
-              AND a.occasion = ?
-        ''', (
-            filters.get('gender'),
-            filters.get('age'),
-            filters.get('occasion')
-        ))
-        
-        similar_sessions = [row[0] for row in cursor.fetchall()]
-        
-        if not similar_sessions:
-            conn.close()
-            return 0.0
-        
-        # Считаем лайки и дизлайки этого подарка
-        placeholders = ','.join(['?' for _ in similar_sessions])
-        cursor.execute(f'''
-            SELECT 
-                SUM(CASE WHEN rating = 1 THEN 1 ELSE 0 END) as likes,
-                SUM(CASE WHEN rating = -1 THEN 1 ELSE 0 END) as dislikes
-            FROM ratings
-            WHERE session_id IN ({placeholders}) AND gift_id = ?
-        ''', similar_sessions + [gift_id])
-        
-        row = cursor.fetchone()
-        conn.close()
-        
-        likes = row[0] or 0
-        dislikes = row[1] or 0
-        
-        total = likes + dislikes
-        if total == 0:
-            return 0.0
-        
-        # Рассчитываем скор от -1 до +1
-        score = (likes - dislikes) / total
-        
-        # Учитываем количество оценок (больше оценок = больше доверия)
-        confidence = min(total / 10, 1.0)  # Максимум при 10+ оценках
-        
-        return score * confidence * 3.0  # До ±3 баллов
-        
-    except Exception as e:
-        # Если база аналитики не существует — возвращаем 0
-        return 0.0
+        if collaborative.COLLAB_MAX_STALENESS > 0:
+            scores = collaborative.snapshot.scores(ANALYTICS_DB_PATH, filters)
+        else:
+            scores = _query_collaborative_scores(filters)
+    except Exception:
+        # Если база аналитики не существует — бонусов нет
+        return {}
+    
+    if gift_ids is not None:
+        scores = {gift_id: scores[gift_id] for gift_id in gift_ids if gift_id in scores}
+    
+    return scores
+
+
+def _query_collaborative_scores(filters: dict) -> dict:
+    """Бонусы профиля прямо из profile_gift_stats"""
+    conn = get_connection(ANALYTICS_DB_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT gift_id, likes, dislikes
+        FROM profile_gift_stats
+        WHERE gender = ? AND age = ? AND occasion = ?
+    ''', (
+        filters.get('gender'),
+        filters.get('age'),
+        filters.get('occasion')
+    ))
+    
+    scores = {}
+    for gift_id, likes, dislikes in cursor.fetchall():
+        score = collaborative_score_from_counts(likes or 0, dislikes or 0)
+        if score:
+            scores[gift_id] = score
+    
+    return scores
+
+
+def get_collaborative_score(gift_id: int, filters: dict) -> float:
+    """
+    Рассчитывает бонус на основе лайков похожих пользователей для одного подарка.
+    
+    Для подсчёта по всему каталогу используйте get_collaborative_scores.
+    """
+    return get_collaborative_scores(filters, [gift_id]).get(gift_id, 0.0)
 
 
 def calculate_budget_score(user_max_budget: str, gift_budget_tags: str) -> float:
@@ -81,17 +98,17 @@ def calculate_budget_score(user_max_budget: str, gift_budget_tags: str) -> float
         return 0.0
     user_index = BUDGET_ORDER.index(user_max_budget)
     
-    gift_indices = []
-    for i, tag in enumerate(BUDGET_ORDER):
-        if tag in gift_budget_tags:
-            gift_indices.append(i)
-    
-    if not gift_indices:
+    gift_min_index, gift_max_index = budget_range(parse_tag_set(gift_budget_tags))
+    return budget_score_for_range(user_index, gift_min_index, gift_max_index)
+
+
+def budget_score_for_range(user_index: int, gift_min_index: int, gift_max_index: int) -> float:
+    """
+    Баллы за бюджет по уже посчитанному диапазону подарка (индексы в BUDGET_ORDER).
+    """
+    if gift_min_index < 0:
         return 0.0
     
-    gift_min_index = min(gift_indices)
-    gift_max_index = max(gift_indices)
-    
     if user_index < gift_min_index:
         return -10.0
     
@@ -119,71 +136,53 @@ def calculate_budget_score(user_max_budget: str, gift_budget_tags: str) -> float
         return 2.0
 
 
-def filter_and_score_gifts(filters: dict, value_weights: dict, interest_weights: dict):
+def score_candidates(filters: dict, value_weights: dict, interest_weights: dict) -> list:
     """
-    Фильтрует подарки по PRIMARY тегам и считает score по VALUE/INTERESTS + ЛАЙКИ
+    Фильтрует подарки по PRIMARY тегам и считает score по VALUE/INTERESTS + ЛАЙКИ.
+    
+    Возвращает список (score, interest_matches, collaborative_score, gift) без сортировки.
     """
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM gifts")
-    all_gifts = cursor.fetchall()
-    conn.close()
+    with timed("catalog"):
+        catalog = get_catalog()
+    
+    # Индекс максимального бюджета пользователя
+    user_budget_index = -1
+    if 'budget' in filters and filters['budget']:
+        user_max_budget = filters['budget'][-1]
+        if user_max_budget in BUDGET_ORDER:
+            user_budget_index = BUDGET_ORDER.index(user_max_budget)
+    
+    # Бонусы от похожих пользователей — одним запросом на весь запрос
+    with timed("collaborative"):
+        collaborative_scores = get_collaborative_scores(filters)
     
     results = []
     
-    for gift in all_gifts:
-        gift_id = gift[0]
-        name = gift[1]
-        price = gift[2]
-        description = gift[3]
-        budget_tags = str(gift[4] or '')
-        gender_tags = str(gift[5] or '')
-        age_tags = str(gift[6] or '')
-        relationship_tags = str(gift[7] or '')
-        occasion_tags = str(gift[8] or '')
-        value_tags = str(gift[9] or '')
-        interest_tags = str(gift[10] or '')
-        
-        # === PRIMARY ФИЛЬТРАЦИЯ ===
-        
-        if 'budget' in filters:
-            budget_match = any(b in budget_tags for b in filters['budget'])
-            if not budget_match:
-                continue
-        
-        if 'gender' in filters:
-            if filters['gender'] not in gender_tags:
-                continue
-        
-        if 'age' in filters:
-            if filters['age'] not in age_tags:
-                continue
-        
-        if 'relationship' in filters:
-            if filters['relationship'] not in relationship_tags:
-                continue
-        
-        if 'occasion' in filters:
-            if filters['occasion'] not in occasion_tags:
-                continue
-        
-        # === ПАРСИМ ТЕГИ ПОДАРКА ===
-        def get_tag_value(tags_str, tag_name):
-            for part in tags_str.split(','):
-                part = part.strip()
-                if tag_name in part and ':' in part:
-                    try:
-                        return float(part.split(':')[1])
-                    except:
-                        pass
-            return 0.0
-        
-        gift_practical = get_tag_value(value_tags, 'gift_practical')
-        gift_emotional = get_tag_value(value_tags, 'gift_emotional')
-        gift_experience = get_tag_value(value_tags, 'gift_experience')
-        gift_daily_use = get_tag_value(value_tags, 'gift_daily_use')
-        gift_aesthetic = get_tag_value(value_tags, 'gift_aesthetic')
+    # === PRIMARY ФИЛЬТРАЦИЯ — готовый список из таблицы ранжирования
+    # или пересечение битмапов индекса ===
+    budget_halves = None
+    with timed("filter"):
+        table = get_ranking_table(catalog)
+        precomputed = table.lookup(filters) if table is not None else None
+        if precomputed is not None:
+            rows, budget_halves = precomputed
+            gifts = catalog.gifts
+            candidates = [gifts[row] for row in rows]
+        else:
+            candidates = catalog.candidates(filters)
+    
+    started = time.perf_counter()
+    for position, gift in enumerate(candidates):
+        gift_id = gift.id
+        
+        # === ТЕГИ ПОДАРКА ===
+        gift_values = gift.values
+        gift_practical = gift_values.get('gift_practical', 0.0)
+        gift_emotional = gift_values.get('gift_emotional', 0.0)
+        gift_experience = gift_values.get('gift_experience', 0.0)
+        gift_daily_use = gift_values.get('gift_daily_use', 0.0)
+        gift_aesthetic = gift_values.get('gift_aesthetic', 0.0)
         
         # === ЖЁСТКАЯ ФИЛЬТРАЦИЯ ПО ВЕЩЬ/ВПЕЧАТЛЕНИЕ ===
         user_experience = value_weights.get('gift_experience', 0.5)
@@ -198,9 +197,11 @@ def filter_and_score_gifts(filters: dict, value_weights: dict, interest_weights:
         score = 0.0
         
         # 0. БЮДЖЕТ
-        if 'budget' in filters and filters['budget']:
-            user_max_budget = filters['budget'][-1]
-            budget_score = calculate_budget_score(user_max_budget, budget_tags)
+        if user_budget_index >= 0:
+            if budget_halves is not None:
+                budget_score = budget_halves[position] / 2
+            else:
+                budget_score = budget_score_for_range(user_budget_index, gift.budget_min, gift.budget_max)
             score += budget_score
         
         # 1. Практичный vs Эмоциональный
@@ -242,7 +243,7 @@ def filter_and_score_gifts(filters: dict, value_weights: dict, interest_weights:
         
         for tag, user_weight in interest_weights.items():
             if user_weight > 0:
-                tag_value = get_tag_value(interest_tags, tag)
+                tag_value = gift.interests.get(tag, 0.0)
                 if tag_value > 0:
                     interest_bonus += tag_value * 3.0
                     interest_matches += 1
@@ -255,26 +256,71 @@ def filter_and_score_gifts(filters: dict, value_weights: dict, interest_weights:
             score += 1.5
         
         # 5. КОЛЛАБОРАТИВНАЯ ФИЛЬТРАЦИЯ — лайки похожих пользователей
-        collaborative_score = get_collaborative_score(gift_id, filters)
+        collaborative_score = collaborative_scores.get(gift_id, 0.0)
         score += collaborative_score
         
-        results.append({
-            'id': gift_id,
-            'name': name,
-            'price': price,
-            'description': description,
-            'score': score,
-            'interest_matches': interest_matches,
-            'collaborative_score': collaborative_score
-        })
+        results.append((score, interest_matches, collaborative_score, gift))
+    
+    observe_stage("scoring", time.perf_counter() - started)
+    return results
+
+
+def rank_key(entry) -> tuple:
+    """Порядок выдачи: score по убыванию, при равенстве — id по возрастанию"""
+    return (-entry[0], entry[3].id)
+
+
+def gift_result(entry) -> dict:
+    """Собирает ответ для одного подарка"""
+    score, interest_matches, collaborative_score, gift = entry
+    return {
+        'id': gift.id,
+        'name': gift.name,
+        'price': gift.price,
+        'description': gift.description,
+        'score': score,
+        'interest_matches': interest_matches,
+        'collaborative_score': collaborative_score
+    }
+
+
+def filter_and_score_gifts(filters: dict, value_weights: dict, interest_weights: dict):
+    """
+    Фильтрует подарки по PRIMARY тегам и считает score по VALUE/INTERESTS + ЛАЙКИ.
+    
+    Возвращает все подходящие подарки, отсортированные по score.
+    """
+    results = score_candidates(filters, value_weights, interest_weights)
     
     # Сортируем по score
-    results.sort(key=lambda x: x['score'], reverse=True)
+    results.sort(key=rank_key)
     
-    return results
+    return [gift_result(entry) for entry in results]
 
 
-def get_top_gifts(filters: dict, value_weights: dict, interest_weights: dict, limit: int = 5):
-    """Возвращает топ-N подарков"""
-    results = filter_and_score_gifts(filters, value_weights, interest_weights)
-    return results[:limit]
\ No newline at end of file
+def get_top_gifts(filters: dict, value_weights: dict, interest_weights: dict, limit: int = 5,
+                  backend: str = None):
+    """
+    Возвращает топ-N подарков (при равном score — по возрастанию id).
+    
+    backend — "python" или "numpy", по умолчанию берётся SCORING_BACKEND.
+    """
+    backend = backend or SCORING_BACKEND
+    
+    if backend == "numpy":
+        import scoring_numpy
+        with timed("collaborative"):
+            collaborative_scores = get_collaborative_scores(filters)
+        with timed("scoring"):
+            return scoring_numpy.get_top_gifts(
+                filters, value_weights, interest_weights, collaborative_scores, limit
+            )
+    
+    if backend != "python":
+        raise ValueError(f"Неизвестный бэкенд scoring: {backend}")
+    
+    # Частичный отбор: сортируем и собираем словари только для топ-N
+    results = score_candidates(filters, value_weights, interest_weights)
+    with timed("select"):
+        top = heapq.nsmallest(limit, results, key=rank_key)
+        return [gift_result(entry) for entry in top]
\ No newline at end of file
@@ -0,0 +1,267 @@
+"""
+Векторизованный бэкенд scoring на NumPy.
+
+Каталог хранится матрицами «подарок × признак», score считается сразу для
+всех кандидатов. Правила и порядок операций повторяют
+scoring.score_candidates, поэтому результаты совпадают до бита.
+Включается через SCORING_BACKEND=numpy (нужен пакет numpy).
+"""
+import threading
+
+import numpy as np
+
+from catalog import BUDGET_ORDER, bitmap_positions, get_catalog
+from catalog_mmap import MappedCatalog
+from ranking_table import get_ranking_table
+
+VALUE_TAGS = ("gift_practical", "gift_emotional", "gift_experience",
+              "gift_daily_use", "gift_aesthetic")
+
+
+class CatalogMatrix:
+    """Каталог в виде массивов NumPy"""
+
+    def __init__(self, catalog):
+        gifts = catalog.gifts
+        self.catalog = catalog
+        self.version = catalog.version
+
+        if isinstance(catalog, MappedCatalog):
+            self._from_columns(catalog)
+            return
+
+        self.ids = np.array([gift.id for gift in gifts], dtype=np.int64)
+        self.budget_min = np.array([gift.budget_min for gift in gifts], dtype=np.int64)
+        self.budget_max = np.array([gift.budget_max for gift in gifts], dtype=np.int64)
+
+        # Веса VALUE тегов: столбцы в порядке VALUE_TAGS
+        self.values = np.zeros((len(gifts), len(VALUE_TAGS)), dtype=np.float64)
+        for row, gift in enumerate(gifts):
+            for column, tag in enumerate(VALUE_TAGS):
+                self.values[row, column] = gift.values.get(tag, 0.0)
+
+        # Веса интересов: столбец на каждый тег, встречающийся в каталоге
+        interest_tags = sorted({tag for gift in gifts for tag in gift.interests})
+        self.interest_columns = {tag: column for column, tag in enumerate(interest_tags)}
+        self.interests = np.zeros((len(gifts), len(interest_tags)), dtype=np.float64)
+        for row, gift in enumerate(gifts):
+            for tag, weight in gift.interests.items():
+                self.interests[row, self.interest_columns[tag]] = weight
+
+    def _from_columns(self, catalog):
+        # Колонки catalog.bin используются без копирования (кроме VALUE тегов
+        # в порядке VALUE_TAGS и бюджета в int64)
+        count = len(catalog)
+        self.ids = np.frombuffer(catalog.ids, dtype=np.int64)
+        self.budget_min = np.frombuffer(catalog.budget_min, dtype=np.int8).astype(np.int64)
+        self.budget_max = np.frombuffer(catalog.budget_max, dtype=np.int8).astype(np.int64)
+
+        values = np.frombuffer(catalog.value_matrix, dtype=np.float64).reshape(count, len(catalog.value_tags))
+        self.values = np.zeros((count, len(VALUE_TAGS)), dtype=np.float64)
+        for column, tag in enumerate(VALUE_TAGS):
+            if tag in catalog.value_columns:
+                self.values[:, column] = values[:, catalog.value_columns[tag]]
+
+        self.interest_columns = catalog.interest_columns
+        self.interests = np.frombuffer(catalog.interest_matrix, dtype=np.float64).reshape(
+            count, len(catalog.interest_tags)
+        )
+
+
+_matrix = None
+_matrix_lock = threading.Lock()
+
+
+def get_matrix() -> CatalogMatrix:
+    """Матрицы для текущей версии каталога (пересобираются при перезагрузке каталога)"""
+    global _matrix
+
+    catalog = get_catalog()
+    matrix = _matrix
+    if matrix is not None and matrix.catalog is catalog:
+        return matrix
+
+    with _matrix_lock:
+        if _matrix is None or _matrix.catalog is not catalog:
+            _matrix = CatalogMatrix(catalog)
+        return _matrix
+
+
+def budget_scores(user_index: int, gift_min: np.ndarray, gift_max: np.ndarray) -> np.ndarray:
+    """Векторная версия scoring.budget_score_for_range"""
+    diff = user_index - gift_max
+    span = gift_max - gift_min
+    with np.errstate(divide="ignore", invalid="ignore"):
+        position = (user_index - gift_min) / np.where(span == 0, 1, span)
+
+    in_range = np.select(
+        [span == 0, position <= 0.25, position <= 0.5, position <= 0.75],
+        [2.0, -1.0, 0.0, 1.0],
+        default=2.0,
+    )
+    above_range = np.select(
+        [diff == 1, diff == 2],
+        [0.5, 0.0],
+        default=-0.5 * (diff - 2),
+    )
+
+    return np.select(
+        [gift_min < 0, user_index < gift_min, user_index > gift_max],
+        [0.0, -10.0, above_range],
+        default=in_range,
+    )
+
+
+def score_candidates(filters: dict, value_weights: dict, interest_weights: dict,
+                     collaborative_scores: dict):
+    """
+    Считает score всех кандидатов.
+
+    Возвращает (matrix, rows, scores, interest_matches, collaborative):
+    rows — номера строк каталога, остальные массивы выровнены по ним.
+    """
+    matrix = get_matrix()
+    catalog = matrix.catalog
+
+    # === PRIMARY ФИЛЬТРАЦИЯ ===
+    budget = None
+    table = get_ranking_table(catalog)
+    precomputed = table.lookup(filters) if table is not None else None
+    if precomputed is not None:
+        table_rows, budget_halves = precomputed
+        rows = np.frombuffer(table_rows, dtype=np.uint32).astype(np.int64)
+        budget = np.frombuffer(budget_halves, dtype=np.int8) / 2
+    else:
+        rows = np.array(
+            bitmap_positions(catalog.candidate_bitmap(filters), len(catalog.gifts)),
+            dtype=np.int64,
+        )
+
+    values = matrix.values[rows]
+    gift_practical = values[:, 0]
+    gift_emotional = values[:, 1]
+    gift_experience = values[:, 2]
+    gift_daily_use = values[:, 3]
+    gift_aesthetic = values[:, 4]
+
+    # === ЖЁСТКАЯ ФИЛЬТРАЦИЯ ПО ВЕЩЬ/ВПЕЧАТЛЕНИЕ ===
+    user_experience = value_weights.get('gift_experience', 0.5)
+    keep = np.ones(len(rows), dtype=bool)
+    if user_experience == 0:
+        keep &= ~(gift_experience > 0.7)
+    if user_experience == 1:
+        keep &= ~(gift_experience < 0.3)
+    if not keep.all():
+        rows = rows[keep]
+        if budget is not None:
+            budget = budget[keep]
+        gift_practical = gift_practical[keep]
+        gift_emotional = gift_emotional[keep]
+        gift_daily_use = gift_daily_use[keep]
+        gift_aesthetic = gift_aesthetic[keep]
+
+    # === SCORING ===
+    score = np.zeros(len(rows), dtype=np.float64)
+
+    # 0. БЮДЖЕТ
+    if 'budget' in filters and filters['budget']:
+        user_max_budget = filters['budget'][-1]
+        if budget is not None:
+            score += budget
+        elif user_max_budget in BUDGET_ORDER:
+            user_index = BUDGET_ORDER.index(user_max_budget)
+            score += budget_scores(user_index, matrix.budget_min[rows], matrix.budget_max[rows])
+
+    # 1. Практичный vs Эмоциональный
+    user_practical = value_weights.get('gift_practical', 0.5)
+    user_emotional = value_weights.get('gift_emotional', 0.5)
+
+    if user_practical == 1:
+        score += gift_practical * 2.0
+        score -= gift_emotional * 1.0
+    elif user_emotional == 1:
+        score += gift_emotional * 2.0
+        score -= gift_practical * 0.5
+    else:
+        score += gift_practical * 0.5
+        score += gift_emotional * 0.5
+
+    # 2. Для ежедневного использования
+    user_daily = value_weights.get('gift_daily_use', 0.5)
+
+    if user_daily == 1:
+        score += gift_daily_use * 1.5
+        score -= np.where(gift_daily_use < 0.3, 0.5, 0.0)
+    elif user_daily == 0:
+        score -= np.where(gift_daily_use > 0.7, 0.3, 0.0)
+
+    # 3. Эстетика
+    user_aesthetic = value_weights.get('gift_aesthetic', 0.5)
+
+    if user_aesthetic == 1:
+        score += gift_aesthetic * 1.5
+        score -= np.where(gift_aesthetic < 0.3, 0.5, 0.0)
+
+    # 4. INTERESTS
+    interest_bonus = np.zeros(len(rows), dtype=np.float64)
+    interest_matches = np.zeros(len(rows), dtype=np.int64)
+
+    for tag, user_weight in interest_weights.items():
+        if user_weight > 0:
+            column = matrix.interest_columns.get(tag)
+            if column is None:
+                continue
+            tag_value = matrix.interests[rows, column]
+            matched = tag_value > 0
+            interest_bonus += np.where(matched, tag_value * 3.0, 0.0)
+            interest_matches += matched
+
+    score += interest_bonus
+    score += np.where(interest_matches >= 2, 1.0, 0.0)
+    score += np.where(interest_matches >= 3, 1.5, 0.0)
+
+    # 5. КОЛЛАБОРАТИВНАЯ ФИЛЬТРАЦИЯ
+    collaborative = np.zeros(len(rows), dtype=np.float64)
+    if collaborative_scores:
+        for i, gift_id in enumerate(matrix.ids[rows].tolist()):
+            collaborative[i] = collaborative_scores.get(gift_id, 0.0)
+    score += collaborative
+
+    return matrix, rows, score, interest_matches, collaborative
+
+
+def get_top_gifts(filters: dict, value_weights: dict, interest_weights: dict,
+                  collaborative_scores: dict, limit: int = 5):
+    """Топ-N подарков; при равном score — по возрастанию id, как в Python-бэкенде"""
+    matrix, rows, score, interest_matches, collaborative = score_candidates(
+        filters, value_weights, interest_weights, collaborative_scores
+    )
+
+    if limit <= 0:
+        return []
+
+    # np.partition находит порог N-го места; все подарки с таким же score
+    # тоже попадают в отбор, чтобы порядок среди равных не зависел от разбиения
+    selected = np.arange(len(rows))
+    if limit < len(rows):
+        threshold = -np.partition(-score, limit - 1)[limit - 1]
+        selected = np.flatnonzero(score >= threshold)
+
+    ids = matrix.ids[rows[selected]]
+    order = selected[np.lexsort((ids, -score[selected]))][:limit]
+
+    gifts = matrix.catalog.gifts
+    results = []
+    for i in order.tolist():
+        gift = gifts[rows[i]]
+        results.append({
+            'id': gift.id,
+            'name': gift.name,
+            'price': gift.price,
+            'description': gift.description,
+            'score': float(score[i]),
+            'interest_matches': int(interest_matches[i]),
+            'collaborative_score': float(collaborative[i])
+        })
+
+    return results
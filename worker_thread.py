@@ -0,0 +1,61 @@
+"""
+Фоновые потоки, свои в каждом воркере.
+
+gunicorn форкает воркеры от мастера, поэтому модульные объекты — каталог,
+кэш результатов, писатель аналитики, снимок коллаборативных оценок — у
+каждого воркера свои, по одному на процесс, и общих блокировок между
+процессами нет. Потоки fork не переживают: в дочернем процессе от потока
+родителя остаётся только объект. WorkerThread замечает смену процесса и
+запускает поток заново.
+"""
+import os
+import threading
+
+
+class WorkerThread:
+    """
+    Поток-демон с target, по одному на процесс.
+
+    Запускается при первом ensure_started() в процессе и перезапускается,
+    если завершился. on_new_process вызывается перед первым запуском в
+    каждом процессе — сбросить унаследованное от родителя состояние.
+    """
+
+    def __init__(self, target, name: str, on_new_process=None):
+        self.target = target
+        self.name = name
+        self.on_new_process = on_new_process
+
+        self.pid = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def owned(self) -> bool:
+        """Поток запускался в текущем процессе"""
+        return self.pid == os.getpid()
+
+    def is_alive(self) -> bool:
+        """Поток текущего процесса работает"""
+        return self._thread is not None and self.owned() and self._thread.is_alive()
+
+    def ensure_started(self):
+        """Запускает поток, если в текущем процессе он не работает"""
+        if self.is_alive():
+            return
+
+        with self._lock:
+            if self.is_alive():
+                return
+
+            pid = os.getpid()
+            if self.pid != pid:
+                if self.on_new_process is not None:
+                    self.on_new_process()
+                self.pid = pid
+
+            self._thread = threading.Thread(target=self.target, name=self.name, daemon=True)
+            self._thread.start()
+
+    def join(self, timeout: float = None):
+        if self._thread is not None and self.owned():
+            self._thread.join(timeout)